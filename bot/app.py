@@ -0,0 +1,82 @@
+import asyncio
+
+from configs import logs
+from create_bot import dp, bot
+from configs.env_reader import config
+from handlers.admin import admin
+from handlers.client import client
+from handlers.common import common_handlers
+from handlers.client.menu import set_commands
+from handlers.client.email import email_sender, start_email_test
+from db.operations.messages import migrate_messages, start_messages_retention
+from db.operations.journal import message_journal
+from db.operations.utils.conversion import user_conversion
+from handlers.admin.send_on import send_startup, send_shutdown
+from handlers.admin.matching.sending import resume_matching_client
+from handlers.admin.matching.history import sync_met_index
+from handlers.admin.matching.assignment import start_matching_pool, close_matching_pool
+from db.connect import setup_mongo_connection, close_mongo_connection
+from webhook import run_webhook
+from intake import update_intake, run_polling
+
+
+async def on_startup():
+    """
+    Initializes logging, database connection and the index of users who have already met, starts the matching workers,
+    sends startup notifications and resumes unfinished deliveries of matching results.
+    Email accounts are tested and old messages are deleted in the background.
+    """
+    _ = asyncio.create_task(logs.init_logger())
+    await asyncio.sleep(0)
+
+    await setup_mongo_connection()
+    await migrate_messages()
+    start_messages_retention()
+    await sync_met_index()
+    await user_conversion.warm_up()
+    start_matching_pool()
+    await message_journal.start()
+    await send_startup()
+    await email_sender.start()
+    start_email_test()
+    resume_matching_client()
+
+
+async def on_shutdown():
+    """
+    Finishes the updates in handling, sends shutdown notifications, sends queued emails, flushes the message journal,
+    stops the matching workers and closes the database connection.
+    """
+    await update_intake.stop()
+    await send_shutdown()
+    await email_sender.stop()
+    await message_journal.stop()
+    close_matching_pool()
+
+    close_mongo_connection()
+
+
+async def main():
+    """
+    Registers handlers, sets commands, and starts receiving updates: through the webhook if WEBHOOK_URL is set,
+    by polling otherwise.
+    """
+    try:
+        common_handlers.register_middlewares(dp)
+        common_handlers.register_handler_cancel(dp)
+        admin.register_handlers_admin(dp)
+        client.register_handlers_client(dp)
+        common_handlers.register_handler_zero_message(dp)
+
+        dp.startup.register(on_startup)
+        dp.shutdown.register(on_shutdown)
+
+        await set_commands(bot)
+
+        if config.WEBHOOK_URL is not None:
+            await run_webhook(dp, bot)
+        else:
+            await run_polling(dp, bot)
+    finally:
+        pass
+
@@ -1,4 +1,5 @@
 from pathlib import Path
+from typing import Optional
 from pydantic import SecretStr
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
@@ -13,7 +14,8 @@ env_path = BOT_DIR / ".env"
 
 class Settings(BaseSettings):
     """
-    Reads environment variables including the bot token, MongoDB credentials, and email passwords.
+    Reads environment variables including the bot token, MongoDB credentials, email passwords,
+    the optional Redis URL for the FSM storage, the webhook settings and the retention of the message history.
     """
     TG_BOT_TOKEN: SecretStr
     MONGODB_USERNAME: SecretStr
@@ -24,6 +26,19 @@ class Settings(BaseSettings):
     EMAIL5_PASSWORD: SecretStr
     EMAIL6_PASSWORD: SecretStr
 
+    REDIS_URL: Optional[SecretStr] = None               # FSM states are kept in memory if not set
+    FSM_KEY_PREFIX: str = "valentines"
+    FSM_STATE_TTL: int = 7 * 24 * 60 * 60               # seconds an unfinished conversation is kept
+
+    WEBHOOK_URL: Optional[str] = None                   # public URL of the webhook, updates are polled if not set
+    WEBHOOK_PATH: str = "/webhook"
+    WEBHOOK_SECRET: Optional[SecretStr] = None          # derived from the bot token if not set
+    WEBHOOK_HOST: str = "0.0.0.0"
+    WEBHOOK_PORT: int = 8888
+    UPDATE_CONCURRENCY: int = 64                        # updates handled at once by one process
+
+    MESSAGE_RETENTION_DAYS: Optional[int] = None        # days the message history is kept, forever if not set
+
     model_config: SettingsConfigDict = SettingsConfigDict(
         env_file=env_path,
         env_file_encoding="utf-8"
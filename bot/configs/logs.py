@@ -1,15 +1,24 @@
+import os
 import re
+import gzip
+import json
+import time
+import shutil
 import asyncio
 import logging
+from glob import glob, escape
 from queue import Queue
+from datetime import datetime
 from logging import StreamHandler
 from colorlog import ColoredFormatter
-from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from concurrent.futures import ThreadPoolExecutor
+from logging.handlers import QueueHandler, QueueListener, BaseRotatingHandler
 
 from .env_reader import BOT_DIR
 
 
 logs_path = BOT_DIR / "data" / "logs" / "coffee.log"
+json_logs_path = BOT_DIR / "data" / "logs" / "coffee.jsonl"
 
 logs_path.parent.mkdir(parents=True, exist_ok=True)
 
@@ -24,17 +33,112 @@ class AiogramFilter(logging.Filter):
         return True
 
 
-class RemoveColorCodesFilter(logging.Filter):
+COLOR_CODES = re.compile(r'\x1b\[[0-9;]*m')
+
+
+class PlainFormatter(logging.Formatter):
     """
-    Filter that removes color codes from log messages before writing them to the log file.
+    Formatter for log files: removes color codes from the formatted line, leaving the record untouched for other handlers.
     """
-    def filter(self, record):
-        record.msg = self.remove_color_codes(record.msg)
-        return True
+    def format(self, record):
+        return COLOR_CODES.sub('', super().format(record))
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    Formatter for the machine-readable log: one JSON object per line, without color codes.
+    The `user_id` field of user records is kept as a separate key.
+    """
+    def format(self, record):
+        entry = {
+            "time": self.formatTime(record, "%Y-%m-%d %H:%M:%S"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": COLOR_CODES.sub('', record.getMessage()),
+            "file": record.filename,
+            "line": record.lineno,
+        }
+
+        user_id = getattr(record, "user_id", None)
+        if user_id is not None:
+            entry["user_id"] = user_id
+
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class CompressedRotatingFileHandler(BaseRotatingHandler):
+    """
+    File handler that rotates the file when it exceeds `max_bytes` or is older than `max_age` seconds.
+    Rotated segments are named by time, gzipped in a separate thread, and only the newest `backup_count` are kept.
+    """
+    def __init__(self, filename, max_bytes: int, max_age: float, backup_count: int):
+        super().__init__(filename, 'a', encoding="utf-8", delay=True)
+
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.backup_count = backup_count
+
+        # a file left by the previous run counts from its last write, so restarts don't keep it from rotating
+        self.opened_at = os.path.getmtime(self.baseFilename) if os.path.exists(self.baseFilename) else time.time()
+        self.compressor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="logs_compressor")
 
-    @staticmethod
-    def remove_color_codes(text):
-        return re.sub(r'\x1b\[[0-9;]*m', '', text)
+    def shouldRollover(self, record):
+        return time.time() - self.opened_at >= self.max_age
+
+    def emit(self, record):
+        """
+        Writes the record and rotates the file once it has reached `max_bytes`. The size is checked after the write,
+        so a record is formatted only once and a segment may exceed `max_bytes` by its last record.
+        """
+        super().emit(record)
+
+        try:
+            if self.stream is not None and self.stream.tell() >= self.max_bytes:
+                self.doRollover()
+        except Exception:
+            self.handleError(record)
+
+    def doRollover(self):
+        if self.stream:
+            self.stream.close()
+            self.stream = None
+
+        if os.path.exists(self.baseFilename) and os.path.getsize(self.baseFilename) > 0:
+            rotated = f"{self.baseFilename}.{datetime.now():%Y-%m-%d_%H-%M-%S-%f}"
+            os.rename(self.baseFilename, rotated)
+
+            self.compressor.submit(self.compress, rotated)
+
+        self.opened_at = time.time()
+
+    def compress(self, rotated):
+        """
+        Gzips a rotated segment and removes the oldest compressed segments beyond `backup_count`.
+        """
+        with open(rotated, 'rb') as source, gzip.open(f"{rotated}.gz", 'wb') as target:
+            shutil.copyfileobj(source, target)
+        os.remove(rotated)
+
+        segments = sorted(glob(f"{escape(self.baseFilename)}.*.gz"))
+        for segment in segments[:-self.backup_count]:
+            os.remove(segment)
+
+    def close(self):
+        super().close()
+        self.compressor.shutdown(wait=True)
+
+
+class LazyQueueHandler(QueueHandler):
+    """
+    Queue handler that passes records to the listener as they are.
+    Unlike the default QueueHandler it doesn't format messages in the calling thread:
+    the listener's handlers format a record only if they emit it.
+    """
+    def prepare(self, record):
+        return record
 
 
 colored_console_format = ColoredFormatter(
@@ -50,19 +154,22 @@ colored_console_format = ColoredFormatter(
 )
 
 
-file_format = logging.Formatter("%(levelname)-8s :: %(name)-25s :: %(asctime)s :: %(message)s :: (%(filename)s:%(lineno)d)")
+file_format = PlainFormatter("%(levelname)-8s :: %(name)-25s :: %(asctime)s :: %(message)s :: (%(filename)s:%(lineno)d)")
+
+
+json_format = JsonFormatter()
 
 
 async def init_logger():
     """
-    Initializes the logging system with console and file handlers.
+    Initializes the logging system with console, text file and JSON-lines file handlers.
     Uses a QueueListener to asynchronously handle log messages.
     """
     que = Queue()
 
     root_logger = logging.getLogger()
     root_logger.setLevel(logging.DEBUG)
-    root_logger.addHandler(QueueHandler(que))
+    root_logger.addHandler(LazyQueueHandler(que))
 
     aiogram_logger = logging.getLogger('aiogram')
     aiogram_logger.setLevel(logging.INFO)
@@ -75,12 +182,15 @@ async def init_logger():
     console_handler.setFormatter(colored_console_format)
     console_handler.addFilter(AiogramFilter())
 
-    file_handler = RotatingFileHandler(logs_path)
+    file_handler = CompressedRotatingFileHandler(logs_path, max_bytes=10 * 2**20, max_age=24 * 60 * 60, backup_count=30)
     file_handler.setLevel(logging.DEBUG)
     file_handler.setFormatter(file_format)
-    file_handler.addFilter(RemoveColorCodesFilter())
 
-    listener = QueueListener(que, console_handler, file_handler, respect_handler_level=True)
+    json_handler = CompressedRotatingFileHandler(json_logs_path, max_bytes=20 * 2**20, max_age=24 * 60 * 60, backup_count=30)
+    json_handler.setLevel(logging.DEBUG)
+    json_handler.setFormatter(json_format)
+
+    listener = QueueListener(que, console_handler, file_handler, json_handler, respect_handler_level=True)
 
     try:
         listener.start()
@@ -91,3 +201,6 @@ async def init_logger():
     finally:
         logging.info(f'### Logger has finished working! ###')
         listener.stop()
+
+        file_handler.close()
+        json_handler.close()
@@ -1,8 +1,29 @@
 from aiogram import Bot, Dispatcher
+from aiogram.fsm.storage.redis import RedisStorage, DefaultKeyBuilder
 
 from configs.env_reader import config
 
 
+def create_dispatcher():
+    """
+    Creates the dispatcher with FSM states in Redis if REDIS_URL is set, so conversations survive restarts
+    and can be shared by several bot processes, and in memory otherwise.
+    Redis keys are prefixed with the bot id and expire after FSM_STATE_TTL seconds. Updates of the same user
+    are locked in Redis, so several processes don't handle them at once.
+    """
+    if config.REDIS_URL is None:
+        return Dispatcher()
+
+    storage = RedisStorage.from_url(
+        config.REDIS_URL.get_secret_value(),
+        key_builder=DefaultKeyBuilder(prefix=config.FSM_KEY_PREFIX, with_bot_id=True),
+        state_ttl=config.FSM_STATE_TTL,
+        data_ttl=config.FSM_STATE_TTL
+    )
+
+    return Dispatcher(storage=storage, events_isolation=storage.create_isolation())
+
+
 bot = Bot(token=config.TG_BOT_TOKEN.get_secret_value())
 
-dp = Dispatcher()
+dp = create_dispatcher()
@@ -1 +1 @@
-from . import user_profile, users, messages
\ No newline at end of file
+from . import user_profile, users, messages, journal
\ No newline at end of file
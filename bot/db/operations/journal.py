@@ -0,0 +1,170 @@
+import asyncio
+import logging
+from pymongo.errors import BulkWriteError
+
+from db.connect import get_mongo_messages
+
+
+WRITE_ATTEMPTS = 3
+WRITE_BACKOFF = 0.5                                     # seconds before the first retry of a write, doubled for every next one
+
+
+class MessageJournal:
+    """
+    Write-behind buffer for the message history.
+    Entries are queued in memory and written to the MongoDB 'messages' collection in batches,
+    either when `batch_size` entries are collected or `flush_interval` seconds have passed.
+    The queue is bounded, so producers wait when MongoDB can't keep up.
+    Failed writes are retried with backoff, and a batch that still isn't written goes back to the queue
+    as far as there is room. Entries that don't fit are lost, they are counted in `lost` and reported on stop.
+    """
+    def __init__(self, max_size: int = 10000, batch_size: int = 500, flush_interval: float = 0.5,
+                 attempts: int = WRITE_ATTEMPTS, backoff: float = WRITE_BACKOFF) -> None:
+        self.max_size = max_size
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.attempts = attempts
+        self.backoff = backoff
+
+        self.queue = None
+        self.task = None
+        self.lost = 0
+
+    async def start(self):
+        """
+        Starts the background task that flushes queued entries to MongoDB.
+        """
+        self.queue = asyncio.Queue(maxsize=self.max_size)
+        self.task = asyncio.create_task(self._run())
+
+        logging.info("### Message journal has started working! ###")
+
+        return
+
+    async def put(self, entry: dict):
+        """
+        Queues an entry for writing. Writes it directly if the journal is not running.
+        """
+        if self.task is None:
+            if not await self._write([entry]):
+                self._lose(1)
+            return
+
+        await self.queue.put(entry)
+
+        return
+
+    async def stop(self):
+        """
+        Flushes all queued entries, including the ones put back by failed writes, and stops the background task.
+        """
+        if self.task is None:
+            return
+
+        await self.queue.put(None)
+        await self.task
+
+        self.task = None
+
+        remaining = []
+        while not self.queue.empty():
+            entry = self.queue.get_nowait()
+            if entry is not None:
+                remaining.append(entry)
+
+        if remaining and not await self._write(remaining):
+            self._lose(len(remaining))
+
+        if self.lost:
+            logging.error(f"process='message journal'                 !! {self.lost} messages were lost.")
+
+        logging.info("### Message journal has finished working! ###")
+
+        return
+
+    async def _run(self):
+        """
+        Collects entries into batches and writes them until the stop sentinel is received.
+        """
+        loop = asyncio.get_running_loop()
+
+        while True:
+            entry = await self.queue.get()
+            if entry is None:
+                return
+
+            batch = [entry]
+            stopping = False
+            deadline = loop.time() + self.flush_interval
+
+            while len(batch) < self.batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+
+                try:
+                    entry = await asyncio.wait_for(self.queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+
+                if entry is None:
+                    stopping = True
+                    break
+
+                batch.append(entry)
+
+            if not await self._write(batch):
+                self._requeue(batch)
+
+            if stopping:
+                return
+
+    async def _write(self, batch: list):
+        """
+        Writes a batch of entries to MongoDB with a single `insert_many`, retrying with backoff.
+        `insert_many` gives the entries their IDs, so entries written by a failed attempt are duplicates
+        on the next one and are skipped. Returns whether the batch was written.
+        """
+        mongo_messages = get_mongo_messages()
+
+        for attempt in range(self.attempts):
+            if attempt:
+                await asyncio.sleep(self.backoff * 2 ** (attempt - 1))
+
+            try:
+                await mongo_messages.insert_many(batch, ordered=False)
+                return True
+            except BulkWriteError as e:
+                if all(error["code"] == 11000 for error in e.details["writeErrors"]):     # 11000 - duplicate key
+                    return True
+                logging.exception(f"\nERROR: [Error writing {len(batch)} messages to MongoDB]\nTRACEBACK:")
+            except Exception:
+                logging.exception(f"\nERROR: [Error writing {len(batch)} messages to MongoDB]\nTRACEBACK:")
+
+        return False
+
+    def _requeue(self, batch: list):
+        """
+        Puts the entries of a batch that wasn't written back to the queue as far as there is room, losing the rest.
+        """
+        room = max(self.max_size - self.queue.qsize(), 0)
+
+        for entry in batch[:room]:
+            self.queue.put_nowait(entry)
+
+        if len(batch) > room:
+            self._lose(len(batch) - room)
+
+        return
+
+    def _lose(self, count: int):
+        """
+        Counts entries that couldn't be written.
+        """
+        self.lost += count
+        logging.error(f"process='message journal'                 !! {count} messages couldn't be written and were lost.")
+
+        return
+
+
+message_journal = MessageJournal()
@@ -1,39 +1,68 @@
+import asyncio
 import logging
 from aiogram import types
-from datetime import datetime
+from datetime import datetime, timedelta
+from pymongo.errors import BulkWriteError
 
 from create_bot import bot
-from db.connect import get_mongo_messages
+from configs.env_reader import config
+from db.connect import get_mongo_messages, get_mongo_meta
+from db.operations.journal import message_journal
 from db.operations.user_profile import new_user
-from db.operations.utils.conversion import user_conversion
-from db.operations.utils.mongo_errors import MongoDBUserNotFound
+from db.operations.utils.conversion import user_conversion, user_log
+
+
+MESSAGE_FIELDS = {"_id": 0, "side": 1, "datetime": 1, "message": 1}
+MESSAGE_ORDER = [("datetime", 1), ("_id", 1)]
+MIGRATION_MARKER = "messages_per_document"             # 'meta' document recording that histories are converted
+RETENTION_INTERVAL = 24 * 60 * 60                       # seconds between deletions of messages past the retention
+
+background_tasks = set()
 
 
 async def find_messages(user_id: int):
     """
-    Retrieves messages of a user from MongoDB. Raises an exception if the user is not found.
+    Retrieves all messages of a user from MongoDB in chronological order.
+    Each message is stored as a separate document, so the history has no size limit.
     """
     mongo_messages = get_mongo_messages()
 
-    messages = await mongo_messages.find_one({"_id": user_id}, {"messages": 1})
-    try:
-        messages = messages["messages"]
-    except TypeError:
-        raise MongoDBUserNotFound(f"User {user_id} is not found in MongoDB.")
+    messages_cursor = mongo_messages.find({"user_id": user_id}, MESSAGE_FIELDS).sort(MESSAGE_ORDER)
+    messages = await messages_cursor.to_list(length=None)
 
     return messages
 
 
-async def update_messages(user_id: int, messages):
+async def find_last_messages(user_id: int, n_messages: int, skip: int = 0):
     """
-    Updates the messages for a user in MongoDB.
+    Retrieves the last N messages of a user from MongoDB in chronological order, skipping the newest `skip` ones.
+    The newest messages are read from the end of the (user_id, datetime) index, so the cost doesn't depend on history size.
     """
+    if n_messages <= 0:                                     # limit(0) means "no limit" in MongoDB
+        return []
+
     mongo_messages = get_mongo_messages()
 
-    filter = {"_id": user_id}
-    newvalues = { "$set": {"messages": messages}}
+    messages_cursor = mongo_messages.find({"user_id": user_id}, MESSAGE_FIELDS) \
+                                    .sort([(field, -direction) for field, direction in MESSAGE_ORDER]) \
+                                    .skip(skip) \
+                                    .limit(n_messages)
+    messages = await messages_cursor.to_list(length=n_messages)
+    messages.reverse()
+
+    return messages
+
 
-    await mongo_messages.update_one(filter, newvalues)
+async def append_message(user_id: int, side: str, text: str):
+    """
+    Queues a single message of the user to the message journal, which writes it to MongoDB in a batch.
+    """
+    await message_journal.put({
+        "user_id": user_id,
+        "side": side,
+        "datetime": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        "message": text,
+    })
 
     return
 
@@ -43,8 +72,84 @@ async def delete_messages(user_id: int):
     Deletes the messages for a user from MongoDB.
     """
     mongo_messages = get_mongo_messages()
-    
-    await mongo_messages.delete_one({"_id": user_id})
+
+    await mongo_messages.delete_many({"user_id": user_id})
+
+    return
+
+
+async def delete_messages_before(time_before: str):
+    """
+    Deletes all messages older than the given '%Y-%m-%d %H:%M:%S' timestamp from MongoDB.
+    """
+    mongo_messages = get_mongo_messages()
+
+    result = await mongo_messages.delete_many({"datetime": {"$lt": time_before}})
+
+    logging.info(f"process='messages retention'               !! {result.deleted_count} messages before {time_before} were deleted.")
+
+    return result.deleted_count
+
+
+async def enforce_retention(days: int, interval: float = RETENTION_INTERVAL):
+    """
+    Deletes the messages older than `days` days right away and then every `interval` seconds until cancelled.
+    """
+    while True:
+        try:
+            await delete_messages_before((datetime.now() - timedelta(days=days)).strftime("%Y-%m-%d %H:%M:%S"))
+        except Exception:
+            logging.exception(f"\nERROR: [Error deleting old messages]\nTRACEBACK:")
+
+        await asyncio.sleep(interval)
+
+
+def start_messages_retention():
+    """
+    Starts deleting old messages in the background if MESSAGE_RETENTION_DAYS is set.
+    """
+    if config.MESSAGE_RETENTION_DAYS is None:
+        return None
+
+    task = asyncio.create_task(enforce_retention(config.MESSAGE_RETENTION_DAYS))
+
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+
+    return task
+
+
+async def migrate_messages():
+    """
+    Converts users' histories from the old layout ({"_id": user_id, "messages": [...]})
+    into one document per message. Once all histories are converted, a marker in the 'meta' collection is written
+    and later starts skip the unindexed search for old histories.
+    Migrated messages get deterministic IDs, so a migration interrupted before the old document was deleted
+    is safely repeated on the next start.
+    """
+    mongo_messages = get_mongo_messages()
+    mongo_meta = get_mongo_meta()
+
+    if await mongo_meta.find_one({"_id": MIGRATION_MARKER}) is not None:
+        return
+
+    legacy_cursor = mongo_messages.find({"messages": {"$exists": True}})
+
+    async for legacy in legacy_cursor:
+        user_id = legacy["_id"]
+        messages = [{"_id": f"{user_id}:{i}", "user_id": user_id, **msg} for i, msg in enumerate(legacy["messages"])]
+
+        if messages:
+            try:
+                await mongo_messages.insert_many(messages, ordered=False)
+            except BulkWriteError as e:
+                if any(error["code"] != 11000 for error in e.details["writeErrors"]):       # 11000 - duplicate key
+                    raise
+        await mongo_messages.delete_one({"_id": user_id})
+
+        logging.info(f"process='messages migration'               !! {len(messages)} messages of user {user_id} were migrated.")
+
+    await mongo_meta.update_one({"_id": MIGRATION_MARKER}, {"$set": {"done": datetime.now()}}, upsert=True)
 
     return
 
@@ -56,23 +161,15 @@ async def send_msg_user(
     reply_markup: types.ReplyKeyboardMarkup = None
     ):
     """
-    Sends a message to the user, logs the message, and updates the message history in MongoDB.
+    Sends a message to the user, logs the message, and appends it to the message history in MongoDB.
+    Only delivered messages get into the history, so a failed send can be retried without duplicates.
     """
-    messages = await find_messages(user_id)
-
-    messages.append({
-        "side": "bot",
-        "datetime": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-        "message": text,
-    })
-
-    await update_messages(user_id, messages)
-
     await bot.send_message(user_id, text, reply_markup=reply_markup)
 
-    username = await user_conversion.get(user_id)
+    await append_message(user_id, "bot", text)
+
     fail = " \033[91m[FAIL]\033[0m" if fail else ''
-    logging.info(f"_id={user_id:<10} {username} \033[36m<<\033[0m{fail} {repr(text)}")
+    user_log.info("\033[36m<<\033[0m%s %r", fail, text, user_id=user_id)
 
     return
 
@@ -80,27 +177,18 @@ async def send_msg_user(
 @new_user
 async def recieve_msg_user(
     message: types.Message, 
-    pending: bool = False, 
     zero_message: bool = False,
     ):
     """
-    Receives a message from a user, logs it, and updates the message history in MongoDB.
+    Receives a message from a user, logs it, and appends it to the message history in MongoDB.
     """
     user_id = message.from_user.id
 
-    messages = await find_messages(user_id)
-
-    messages.append({
-        "side": "user",
-        "datetime": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-        "message": message.text,
-    })
+    await user_conversion.get(user_id)                      # raises MongoDBUserNotFound for new users; cached for known ones
 
-    await update_messages(user_id, messages)
+    await append_message(user_id, "user", message.text)
 
-    username = await user_conversion.get(user_id)
-    pending = " \033[91m[Pending]\033[0m" if pending else ''
     zero_message = " \033[91m[ZeroMessage]\033[0m" if zero_message else ''
-    logging.info(f"_id={user_id:<10} {username} \033[35m>>\033[0m{pending}{zero_message} {repr(message.text)}")
+    user_log.info("\033[35m>>\033[0m%s %r", zero_message, message.text, user_id=user_id)
 
     return
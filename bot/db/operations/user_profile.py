@@ -1,21 +1,28 @@
+import asyncio
 import logging
-from aiogram import types
 from functools import wraps
-from datetime import datetime
+from pymongo import UpdateOne
+from aiogram import types, exceptions
+from datetime import datetime, timedelta
 
 from create_bot import bot
-from db.operations.utils.conversion import user_conversion
-from db.operations.users import update_user, find_all_users
+from db.operations.utils.session import current_session
+from db.operations.utils.conversion import user_conversion, user_log
+from db.operations.users import find_all_users
 from db.operations.utils.mongo_errors import MongoDBUserNotFound
-from db.connect import get_mongo_users, get_mongo_messages, get_mongo_matches
+from db.connect import get_mongo_users, get_mongo_messages, get_mongo_matches, get_mongo_match_results, get_mongo_outbox, get_mongo_met
+
+
+ACTUALIZE_WORKERS = 20
+ACTUALIZE_ATTEMPTS = 3
+ACTUALIZE_FRESHNESS = timedelta(minutes=30)
 
 
 async def create_user(message: types.Message):
     """
-    Creates a new user in the MongoDB 'users' and 'messages' collections with the initial structure.
+    Creates a new user in the MongoDB 'users' collection with the initial structure and returns it.
     """
     mongo_users = get_mongo_users()
-    mongo_messages = get_mongo_messages()
 
     user_id = message.from_user.id
 
@@ -70,18 +77,12 @@ async def create_user(message: types.Message):
         "cache": {},
     }
 
-    messages_structure = {
-        "_id": user_id,
-        "messages": [],
-    }
-
     await mongo_users.insert_one(user_structure)
-    await mongo_messages.insert_one(messages_structure)
 
-    username = await user_conversion.get(user_id)
-    logging.info(f"_id={user_id:<10} {username} <> was added to DB")
+    user_conversion.put(user_id, message.from_user.username)
+    user_log.info("<> was added to DB", user_id=user_id)
 
-    return
+    return user_structure
 
 
 def new_user(f):
@@ -109,50 +110,83 @@ def new_user(f):
 
 async def delete_everithing():
     """
-    Deletes all entries from the 'users', 'messages', and 'matches' collections in MongoDB.
+    Deletes all entries from the 'users', 'messages', 'matches', 'match_results', 'outbox' and 'met' collections in MongoDB.
     """
     mongo_users = get_mongo_users()
     mongo_messages = get_mongo_messages()
     mongo_matches = get_mongo_matches()
+    mongo_match_results = get_mongo_match_results()
+    mongo_outbox = get_mongo_outbox()
+    mongo_met = get_mongo_met()
 
     await mongo_users.delete_many({})
     await mongo_messages.delete_many({})
     await mongo_matches.delete_many({})
+    await mongo_match_results.delete_many({})
+    await mongo_outbox.delete_many({})
+    await mongo_met.delete_many({})
 
     return
 
 
-async def actualize_user(user_id: int):
+async def fetch_actual_user(user_id: int):
     """
-    Updates the user's profile with their latest username and full name, and marks whether they have blocked the bot.
+    Retrieves the user's latest username and full name from Telegram and returns the changes for their profile,
+    including whether they have blocked the bot. Waits and retries on flood control. Returns None on other errors.
     """
-    try:
-        user: types.User = await bot.get_chat(user_id)
-    except Exception as e:
-        if "Forbidden" in str(e):
-            await update_user(user_id, {"blocked_bot": "yes"})
-        else:
+    for attempt in range(ACTUALIZE_ATTEMPTS):
+        try:
+            user: types.User = await bot.get_chat(user_id)
+        except exceptions.TelegramRetryAfter as e:
+            logging.warning(f"process='actualizing users'               !! Flood control, waiting {e.retry_after} s.")
+            await asyncio.sleep(e.retry_after * (attempt + 1))
+            continue
+        except Exception as e:
+            if "Forbidden" in str(e):
+                return {"blocked_bot": "yes", "time_actualized": datetime.now().strftime("%Y-%m-%d %H:%M:%S")}
+
             logging.exception(f"\nERROR: [Error retrieving chat for user {user_id}]\nTRACEBACK:")
-        
-        return
+            return None
 
-    await update_user(user_id, {
-        "info.username": user.username,
-        "info.full_name": user.full_name,
-        "blocked_bot": "no",
+        return {
+            "info.username": user.username,
+            "info.full_name": user.full_name,
+            "blocked_bot": "no",
+            "time_actualized": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
         }
-    )
 
-    return
+    return None
 
 
-async def actualize_all_users():
+async def actualize_all_users(workers: int = ACTUALIZE_WORKERS, freshness: timedelta = ACTUALIZE_FRESHNESS):
     """
-    Updates the profile information for all users who have active matching enabled.
+    Updates the profile information for all users who weren't actualized within the `freshness` window.
+    Telegram is queried by at most `workers` concurrent requests, and all changes are written with one `bulk_write`.
     """
-    users = await find_all_users(["_id"])
+    mongo_users = get_mongo_users()
+
+    time_fresh = (datetime.now() - freshness).strftime("%Y-%m-%d %H:%M:%S")
+    users = await find_all_users(["_id"], {"time_actualized": {"$not": {"$gte": time_fresh}}})
+
+    semaphore = asyncio.Semaphore(workers)
+
+    async def fetch(user_id):
+        current_session.set(None)                       # runs in its own task, apart from the session of the admin's update
+
+        async with semaphore:
+            return user_id, await fetch_actual_user(user_id)
+
+    results = await asyncio.gather(*(fetch(user["_id"]) for user in users))
+    results = [(user_id, keys_values) for user_id, keys_values in results if keys_values]
+
+    if results:
+        await mongo_users.bulk_write([UpdateOne({"_id": user_id}, {"$set": keys_values}) for user_id, keys_values in results],
+                                     ordered=False)
+
+    for user_id, keys_values in results:
+        if "info.username" in keys_values:
+            user_conversion.put(user_id, keys_values["info.username"])
 
-    for user in users:
-        await actualize_user(user["_id"])
+    logging.info(f"process='actualizing users'               !! {len(results)}/{len(users)} users were actualized.")
 
     return
@@ -1,14 +1,23 @@
-import logging
+from db.connect import get_mongo_users, get_mongo_messages, get_mongo_met, get_mongo_match_results
+from db.operations.utils.session import current_session
+from db.operations.utils.conversion import user_conversion, user_log
 
-from db.connect import get_mongo_users, get_mongo_messages
-from db.operations.utils.conversion import user_conversion
+
+ACTIVE_USERS = {"blocked_bot": "no"}
+ELIGIBLE_USERS = {"blocked_bot": "no", "blocked_matching": "no", "finished_profile": "yes"}     # served by the 'eligibility' index
 
 
 async def update_user(user_id: int, keys_values: dict):
     """
     Updates the specified keys and values for a user in the MongoDB 'users' collection.
     Logs the changes made.
+    While the user's update is being handled, changes are collected in the session and committed once at the end.
     """
+    session = current_session.get()
+    if session is not None and session.serves(user_id):
+        session.set(keys_values)
+        return
+
     mongo_users = get_mongo_users()
 
     filter = {"_id": user_id}
@@ -16,8 +25,12 @@ async def update_user(user_id: int, keys_values: dict):
 
     await mongo_users.update_one(filter, newvalues)
 
-    username = await user_conversion.get(user_id)
-    logging.info(f"_id={user_id:<10} {username} <> {list(newvalues['$set'].keys())} were updated in DB.")
+    if "info.username" in keys_values:
+        user_conversion.put(user_id, keys_values["info.username"])
+    elif "info" in keys_values:
+        user_conversion.invalidate(user_id)
+
+    user_log.info("<> %s were updated in DB.", list(newvalues['$set'].keys()), user_id=user_id)
 
     return
 
@@ -26,7 +39,12 @@ async def find_user(user_id: int, keys: list = []):
     """
     Retrieves a user from the MongoDB 'users' collection based on user ID.
     Specific fields can be retrieved by providing keys.
+    While the user's update is being handled, the user is read from the session instead.
     """
+    session = current_session.get()
+    if session is not None and session.serves(user_id):
+        return session.find(keys)
+
     mongo_users = get_mongo_users()
 
     keys = {k: 1 for k in keys}
@@ -39,19 +57,19 @@ async def find_user(user_id: int, keys: list = []):
     return user
 
 
-async def find_all_users(keys: list = []):
+async def find_all_users(keys: list = [], query: dict = {}):
     """
     Retrieves all users from the MongoDB 'users' collection.
-    Specific fields can be retrieved by providing keys.
+    Specific fields can be retrieved by providing keys, and users can be filtered on the server by providing a query.
     """
     mongo_users = get_mongo_users()
 
     keys = {k: 1 for k in keys}
 
     if keys:
-        users_cursor = mongo_users.find({}, keys)
+        users_cursor = mongo_users.find(query, keys)
     else:
-        users_cursor = mongo_users.find()
+        users_cursor = mongo_users.find(query)
 
     users = await users_cursor.to_list(length=None)
 
@@ -64,9 +82,15 @@ async def delete_user(user_id: int):
     """
     mongo_users = get_mongo_users()
     mongo_messages = get_mongo_messages()
+    mongo_met = get_mongo_met()
+    mongo_match_results = get_mongo_match_results()
     
     await mongo_users.delete_one({"_id": user_id})
-    await mongo_messages.delete_one({"_id": user_id})
+    await mongo_messages.delete_many({"user_id": user_id})
+    await mongo_met.delete_one({"_id": user_id})
+    await mongo_match_results.delete_many({"user_id": user_id})
+
+    user_conversion.invalidate(user_id)
 
     return
 
@@ -1 +1 @@
-from . import conversion, mongo_errors
\ No newline at end of file
+from . import conversion, mongo_errors, session
\ No newline at end of file
@@ -1,28 +1,95 @@
 import re
-import asyncio
+import time
 import logging
+from collections import OrderedDict
 
 from db.connect import get_mongo_users
 from configs.selected_ids import ADMINS
 from db.operations.utils.mongo_errors import MongoDBUserNotFound
 
-username_id = {}
-dict_lock = asyncio.Lock()
+
+ANSI_ESCAPE = re.compile(r'\x1B[@-_][0-?]*[ -/]*[@-~]')
 
 
 class UserConversion:
     """
     Handles the conversion of user IDs to their respective usernames with caching.
     If the user is an admin, an admin label is appended to the username.
+    The cache is a bounded LRU whose entries expire after `ttl` seconds; entries are replaced or
+    invalidated when a username changes. Reads don't take locks, since they never await in between.
     """
-    def __init__(self) -> None:
-        self.users_dict = {}
-        self.dict_lock = asyncio.Lock()
+    def __init__(self, max_size: int = 10000, ttl: float = 6 * 60 * 60) -> None:
+        self.max_size = max_size
+        self.ttl = ttl
+        self.users_dict = OrderedDict()                 # _id -> (formatted username, expiration time)
+
+    @staticmethod
+    def format(_id, username):
+        """
+        Formats a username for logs: appends the admin label and pads it to a fixed visible width.
+        """
+        if not isinstance(username, str):
+            username = "NONE"
+
+        if _id in ADMINS:
+            username += " \033[92m[admin]\033[0m"
+
+        username_stripped = ANSI_ESCAPE.sub('', username)
+
+        return f"({username + ')':<{25 + len(username) - len(username_stripped)}}"
+
+    def put(self, _id, username):
+        """
+        Caches the formatted username for the given user ID and returns it, evicting the least recently used entry if full.
+        """
+        username = self.format(_id, username)
+
+        self.users_dict[_id] = (username, time.monotonic() + self.ttl)
+        self.users_dict.move_to_end(_id)
+
+        while len(self.users_dict) > self.max_size:
+            self.users_dict.popitem(last=False)
+
+        return username
+
+    def peek(self, _id):
+        """
+        Returns the cached username for the given user ID, or None if it is not cached or has expired.
+        Never queries MongoDB.
+        """
+        entry = self.users_dict.get(_id)
+        if entry is None:
+            return None
+
+        username, expires = entry
+        if expires < time.monotonic():
+            self.users_dict.pop(_id, None)
+            return None
+
+        self.users_dict.move_to_end(_id)
+
+        return username
+
+    def cached(self, _id):
+        """
+        Returns the cached username for the given user ID even if it has expired, or None if it is not cached.
+        Doesn't modify the cache, so it is safe to call from the logging thread.
+        """
+        entry = self.users_dict.get(_id)
+
+        return entry[0] if entry is not None else None
+
+    def invalidate(self, _id):
+        """
+        Removes the cached username for the given user ID.
+        """
+        self.users_dict.pop(_id, None)
+
+        return
 
     async def add(self, _id):
         """
         Retrieves a username from MongoDB for the given user ID and caches it.
-        If the user is an admin, appends an admin label to the username.
         """
         mongo_users = get_mongo_users()
 
@@ -33,34 +100,66 @@ class UserConversion:
         except TypeError:
             raise MongoDBUserNotFound(f"User with id {_id} is not found in MongoDB.")
 
-        if _id in ADMINS:
-            username += " \033[92m[admin]\033[0m"
-
-        try:
-            username_stripped = re.compile(r'\x1B[@-_][0-?]*[ -/]*[@-~]').sub('', username)
-        except:
-            logging.exception(f"\nERROR: [Error doing `UserConversion.add` for user with _id={_id}]")
-            username = "NONE"
-            username_stripped = "NONE"
-
-        username = f"({username + ')':<{25 + len(username) - len(username_stripped)}}"
-
-        async with self.dict_lock:
-            self.users_dict[_id] = username
-
-        return username
+        return self.put(_id, username)
 
     async def get(self, _id):
         """
         Retrieves the cached username for a user ID or fetches it from MongoDB if not cached.
         """
-        async with self.dict_lock:
-            username = self.users_dict.get(_id)
+        username = self.peek(_id)
 
         if username is None:
             username = await self.add(_id)
 
         return username
 
+    async def warm_up(self):
+        """
+        Fills the cache with usernames of all users with one projection query.
+        """
+        mongo_users = get_mongo_users()
+
+        users_cursor = mongo_users.find({}, {"info.username": 1}).limit(self.max_size)
+
+        async for user in users_cursor:
+            self.put(user["_id"], user.get("info", {}).get("username"))
+
+        logging.info(f"process='user conversion'                !! {len(self.users_dict)} usernames were cached.")
+
+        return
+
 
 user_conversion = UserConversion()
+
+
+class UserRecordMessage:
+    """
+    Log message about a specific user. The username is resolved from the cache only when
+    the record is formatted, i.e. in the logging thread and only if some handler emits it.
+    """
+    __slots__ = ("user_id", "msg")
+
+    def __init__(self, user_id, msg) -> None:
+        self.user_id = user_id
+        self.msg = msg
+
+    def __str__(self):
+        username = user_conversion.cached(self.user_id) or user_conversion.format(self.user_id, None)
+
+        return f"_id={self.user_id:<10} {username} {self.msg}"
+
+
+class UserLogAdapter(logging.LoggerAdapter):
+    """
+    Logger adapter for records about a specific user, passed as the `user_id` keyword.
+    The user ID is stored on the record as a field, and formatting is deferred to the logging thread:
+        user_log.info("<< %r", text, user_id=user_id)
+    """
+    def process(self, msg, kwargs):
+        user_id = kwargs.pop("user_id")
+        kwargs["extra"] = {**kwargs.get("extra", {}), "user_id": user_id}
+
+        return UserRecordMessage(user_id, msg), kwargs
+
+
+user_log = UserLogAdapter(logging.getLogger(), {})
@@ -0,0 +1,86 @@
+import copy
+from contextvars import ContextVar
+
+
+current_session = ContextVar("current_session", default=None)
+
+MISSING = object()
+
+
+def get_path(document: dict, key: str):
+    """
+    Returns the value under a dotted key (e.g. "info.program.name") or MISSING if there is none.
+    """
+    for part in key.split('.'):
+        if not isinstance(document, dict) or part not in document:
+            return MISSING
+        document = document[part]
+
+    return document
+
+
+def set_path(document: dict, key: str, value):
+    """
+    Sets the value under a dotted key, creating intermediate dictionaries like MongoDB's `$set` does.
+    """
+    *parents, last = key.split('.')
+
+    for part in parents:
+        document = document.setdefault(part, {})
+    document[last] = value
+
+    return
+
+
+class UserSession:
+    """
+    Holds the user's document for the duration of one update.
+    Reads of the user are served from the loaded document and writes are collected,
+    so that they can be committed to MongoDB with a single `$set` at the end of the update.
+    Tasks started during the update copy the session with their context; once it is committed,
+    they read and write MongoDB directly instead.
+    """
+    def __init__(self, user_id: int, user: dict) -> None:
+        self.user_id = user_id
+        self.user = user
+        self.updates = {}
+        self.committed = False
+
+    def serves(self, user_id: int):
+        """
+        Returns whether reads and writes of the user go through this session.
+        """
+        return not self.committed and self.user_id == user_id
+
+    def find(self, keys: list = []):
+        """
+        Returns a copy of the loaded document, limited to the given dotted keys the way a MongoDB projection would be.
+        """
+        if not keys:
+            return copy.deepcopy(self.user)
+
+        projected = {"_id": self.user["_id"]}
+
+        for key in keys:
+            value = get_path(self.user, key)
+            if value is not MISSING:
+                set_path(projected, key, copy.deepcopy(value))
+
+        return projected
+
+    def set(self, keys_values: dict):
+        """
+        Applies dotted-key updates to the loaded document and merges them into the pending `$set`.
+        Overlapping keys are merged, so the final `$set` never has conflicting paths.
+        """
+        for key, value in keys_values.items():
+            set_path(self.user, key, copy.deepcopy(value))
+
+            for pending in list(self.updates):
+                if pending.startswith(key + '.'):
+                    del self.updates[pending]
+
+            parent = next((pending for pending in self.updates if key.startswith(pending + '.')), key)
+            self.updates[parent] = copy.deepcopy(get_path(self.user, parent))
+
+        return
@@ -1 +1 @@
-from . import admin, admin_filter, matching, commands, send_on
\ No newline at end of file
+from . import admin, admin_filter, matching, commands, send_on, broadcast
\ No newline at end of file
@@ -0,0 +1,123 @@
+import time
+import asyncio
+import logging
+from aiogram import exceptions
+
+from rate_limiter import telegram_limiter
+from db.operations.users import update_user
+from db.operations.messages import send_msg_user
+from db.operations.utils.session import current_session
+
+
+BROADCAST_WORKERS = 16
+MAX_ATTEMPTS = 3
+
+background_tasks = set()
+
+
+SENT = "sent"
+BLOCKED = "blocked"
+FAILED = "failed"
+
+
+class BroadcastReport:
+    """
+    Counts the outcomes of a broadcast.
+    """
+    def __init__(self, total: int) -> None:
+        self.total = total
+        self.outcomes = {SENT: 0, BLOCKED: 0, FAILED: 0}
+        self.started = time.monotonic()
+
+    def add(self, outcome: str):
+        self.outcomes[outcome] += 1
+
+    def summary(self):
+        elapsed = time.monotonic() - self.started
+        speed = self.outcomes[SENT] / elapsed if elapsed > 0 else 0
+
+        return (f"Рассылка завершена за {elapsed:.1f} с ({speed:.1f} сообщений/с)\n\n"
+                f"Отправлено: {self.outcomes[SENT]}/{self.total}\n"
+                f"Заблокировали бота: {self.outcomes[BLOCKED]}\n"
+                f"Ошибки: {self.outcomes[FAILED]}")
+
+
+async def send_limited(user_id: int, text: str):
+    """
+    Sends one message under the Telegram rate limits and returns the outcome: SENT, BLOCKED or FAILED.
+    Waits and retries on RetryAfter, marks users who blocked the bot.
+    """
+    for _ in range(MAX_ATTEMPTS):
+        await telegram_limiter.wait(user_id)
+
+        try:
+            await send_msg_user(user_id, text)
+            return SENT
+
+        except exceptions.TelegramRetryAfter as e:
+            logging.warning(f"process='broadcast'                       !! Flood control, waiting {e.retry_after} s.")
+            telegram_limiter.pause(e.retry_after)
+
+        except exceptions.TelegramForbiddenError:
+            await update_user(user_id, {"blocked_bot": "yes"})
+            return BLOCKED
+
+        except exceptions.TelegramAPIError:
+            logging.exception(f"\nERROR: [Error sending message to user {user_id}]\nTRACEBACK:")
+            return FAILED
+
+    return FAILED
+
+
+async def broadcast(user_ids: list, text: str, workers: int = BROADCAST_WORKERS):
+    """
+    Sends the text to all given users with a bounded pool of concurrent workers and returns the report.
+    """
+    report = BroadcastReport(len(user_ids))
+
+    queue = asyncio.Queue()
+    for user_id in user_ids:
+        queue.put_nowait(user_id)
+
+    async def worker():
+        while not queue.empty():
+            user_id = queue.get_nowait()
+
+            try:
+                outcome = await send_limited(user_id, text)
+            except Exception:
+                logging.exception(f"\nERROR: [Error broadcasting to user {user_id}]\nTRACEBACK:")
+                outcome = FAILED
+
+            report.add(outcome)
+
+    await asyncio.gather(*(worker() for _ in range(min(workers, len(user_ids)))))
+
+    logging.info(f"process='broadcast'                       !! {report.total} users: {report.outcomes}.")
+
+    return report
+
+
+async def broadcast_and_report(admin_id: int, user_ids: list, text: str):
+    """
+    Runs a broadcast and sends its report to the admin who started it.
+    """
+    current_session.set(None)                           # the task must not use the session of the admin's update
+
+    report = await broadcast(user_ids, text)
+
+    await send_msg_user(admin_id, report.summary())
+
+    return
+
+
+def start_broadcast(admin_id: int, user_ids: list, text: str):
+    """
+    Starts a broadcast in the background, so the admin's update handling isn't blocked by it.
+    """
+    task = asyncio.create_task(broadcast_and_report(admin_id, user_ids, text))
+
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+
+    return task
@@ -8,12 +8,14 @@ from aiogram.filters.command import Command, CommandObject
 
 from handlers.common.checks import checker
 from handlers.admin.matching import sending
+from handlers.admin.broadcast import start_broadcast
 from db.operations.messages import send_msg_user
 from handlers.admin.admin_filter import AdminFilter
-from handlers.admin.matching.assignment import match
+from handlers.admin.matching.assignment import match, MATCHING_MODES, GREEDY
 from handlers.admin.matching.save import save_matching
+from handlers.admin.matching.history import index_matching_run
 from db.operations.user_profile import actualize_all_users
-from db.operations.users import find_id_by_username, find_all_users, delete_user, update_user
+from db.operations.users import find_id_by_username, find_all_users, delete_user, update_user, ACTIVE_USERS
 
 router = Router()
 
@@ -46,45 +48,71 @@ class DeleteUserStates(StatesGroup):
     CONFIRMED = State()
 
 
+async def matching_mode(message: types.Message, command: CommandObject):
+    """
+    Returns the matching mode given as the command argument, GREEDY by default.
+    Returns None and tells the admin the available modes if the argument is not one of them.
+    """
+    mode = command.args.strip() if command.args else GREEDY
+
+    if mode not in MATCHING_MODES:
+        await send_msg_user(message.from_user.id, f"Неизвестный режим мэтчинга. Доступны: {', '.join(MATCHING_MODES)}")
+        return None
+
+    return mode
+
+
 @router.message(StateFilter(None), Command("match"), AdminFilter())
 @checker
-async def cmd_match(message: types.Message):
+async def cmd_match(message: types.Message, command: CommandObject):
     """
     Executes the matching process, saving the results and notifying admins and users.
+    The matching mode can be given as an argument: /match optimal.
     """
+    mode = await matching_mode(message, command)
+    if mode is None:
+        return
+
     time_started = datetime.now().strftime('%Y-%m-%d_%H:%M:%S')
 
     await actualize_all_users()
     logging.info(f"process='matching'                        !! Data of active users was actualized.")
  
-    matched_df = await match()
+    matched, stats = await match(mode)
     logging.info(f"process='matching'                        !! Users were matched; Emojis were attached.")
 
-    await save_matching(matched_df, time_started)
+    await save_matching(matched, time_started, stats)
     logging.info(f"process='matching'                        !! Results of matching were saved.")
 
-    await sending.send_matching_admin(matched_df)
+    await index_matching_run(time_started, ((result.user_id, result.username, result.assignments) for result in matched))
+
+    await sending.send_matching_admin(matched, stats)
     logging.info(f"process='matching'                        !! Admins were notified.")
 
-    await sending.send_matching_client(matched_df)
-    logging.info(f"process='matching'                        !! Users were notified.")
+    await sending.send_matching_client(matched, time_started, message.from_user.id)
+    logging.info(f"process='matching'                        !! Users are being notified in the background.")
 
     return
 
 
 @router.message(StateFilter(None), Command("pseudo_match"), AdminFilter())
 @checker
-async def cmd_pseudo_match(message: types.Message):
+async def cmd_pseudo_match(message: types.Message, command: CommandObject):
     """
     Simulates the matching process and notifies admins of the results without saving them.
+    The matching mode can be given as an argument: /pseudo_match optimal.
     """
+    mode = await matching_mode(message, command)
+    if mode is None:
+        return
+
     await actualize_all_users()
     logging.info(f"process='matching'                        !! Data of active users was actualized.")
  
-    matched_df = await match()
+    matched, stats = await match(mode)
     logging.info(f"process='matching'                        !! Users were matched; Emojis were attached.")
 
-    await sending.send_matching_admin(matched_df)
+    await sending.send_matching_admin(matched, stats)
     logging.info(f"process='matching'                        !! Admins were notified.")
 
     return
@@ -165,13 +193,12 @@ async def cmd_send_message_to_group(message: types.Message, command: CommandObje
 @checker
 async def send_message_to_group_message(message: types.Message, state: FSMContext):
     """
-    Sends the admin's message to the specified group of users user and clears the state.
+    Starts sending the admin's message to the specified group of users and clears the state.
     """
     user_data = await state.get_data()
     user_ids = user_data['user_ids']
 
-    for user_id in user_ids:
-        await send_msg_user(user_id, message.text)
+    start_broadcast(message.from_user.id, user_ids, message.text)
 
     await state.clear()
 
@@ -195,13 +222,13 @@ async def cmd_send_message_to_all(message: types.Message, state: FSMContext):
 @checker
 async def send_message_to_all_message(message: types.Message, state: FSMContext):
     """
-    Sends the admin's message to all users who have not blocked the bot and are active for matching.
+    Starts sending the admin's message to all users who have not blocked the bot; the admin gets a report when it's done.
     """
-    users = await find_all_users(["_id", "info.username", "blocked_bot"])
+    users = await find_all_users(["_id"], ACTIVE_USERS)
+
+    start_broadcast(message.from_user.id, [user["_id"] for user in users], message.text)
 
-    for user in users:
-        if user["blocked_bot"] == "no":
-            await send_msg_user(user["_id"], message.text)
+    await send_msg_user(message.from_user.id, f"Рассылка на {len(users)} пользователей началась, пришлем отчет, когда закончим")
 
     await state.clear()
 
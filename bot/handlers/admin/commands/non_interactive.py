@@ -9,8 +9,9 @@ from configs.logs import logs_path
 from configs.env_reader import TEMP_DIR
 from handlers.common.checks import checker
 from handlers.admin.admin_filter import AdminFilter
-from db.operations.messages import send_msg_user, find_messages
+from db.operations.messages import send_msg_user, find_last_messages
 from db.operations.users import find_user, find_id_by_username, find_all_users
+from handlers.admin.matching.save import find_last_results
 
 
 router = Router()
@@ -38,7 +39,7 @@ async def cmd_admin(message: types.Message):
     Sends a list of available admin commands to the user.
     """
     await send_msg_user(message.from_user.id, 
-                        """/logs - текущие логи;\n\n/all_users - данные всех пользователей;\n\n/messages @tg 15 - последние N сообщений пользователя;\n\n/user @tg - данные пользователя;\n\n/send_message @tg - отправить сообщение пользователю;\n\n/send_message_to_group @tg1 @tg2 - отправить сообщение выбранным пользоватлеям;\n\n/send_message_to_all - отправить сообщение всем пользователям;\n\n/block_matching - заблокировать мэтчинг для пользователя;\n\n/delete_user @tg - удалить пользователя;\n\n/create_user @tg - создать пользователя;\n\n/pseudo_match - сделать мэтчинг;\n\n\n/match - сделать мэтчинг;""")
+                        """/logs - текущие логи;\n\n/all_users - данные всех пользователей;\n\n/messages @tg 15 [2] - последние N сообщений пользователя (и страница более старых);\n\n/user @tg - данные пользователя;\n\n/send_message @tg - отправить сообщение пользователю;\n\n/send_message_to_group @tg1 @tg2 - отправить сообщение выбранным пользоватлеям;\n\n/send_message_to_all - отправить сообщение всем пользователям;\n\n/block_matching - заблокировать мэтчинг для пользователя;\n\n/delete_user @tg - удалить пользователя;\n\n/create_user @tg - создать пользователя;\n\n/pseudo_match [optimal] - сделать мэтчинг без сохранения и отправки;\n\n\n/match [optimal] - сделать мэтчинг (optimal - точнее, но дольше);""")
 
     return
 
@@ -59,20 +60,24 @@ async def cmd_logs(message: types.Message):
 async def cmd_messages(message: types.Message, command: CommandObject):
     """
     Retrieves and sends the last N messages of a specified user to the admin.
+    An optional page number gives older ranges: page 2 is the N messages before the last N, and so on.
     If the message content is too long, it sends it as a temporary file.
     """
-    if not command.args or len(command.args.split()) != 2:
-        await send_msg_user(message.from_user.id, "Введи пользователя и кол-во сообщений:\n/messages @vbalab 30")
+    if not command.args or len(command.args.split()) not in (2, 3) or not all(arg.isdigit() for arg in command.args.split()[1:]):
+        await send_msg_user(message.from_user.id, "Введи пользователя, кол-во сообщений и, если нужно, номер страницы:\n/messages @vbalab 30\n/messages @vbalab 30 2")
         return
 
     args = command.args.split()
     username = args[0].replace('@', '').replace(' ', '')
     n_messages = int(args[1])
+    page = int(args[2]) if len(args) == 3 else 1
 
     requested_user_id = await find_id_by_username(username)
+    if not requested_user_id:
+        await send_msg_user(message.from_user.id, "Этот пользователь не пользуется ботом. Abort")
+        return
 
-    messages = await find_messages(requested_user_id)
-    messages = messages[-n_messages:]
+    messages = await find_last_messages(requested_user_id, n_messages, skip=n_messages * max(page - 1, 0))
     messages_json = json.dumps(messages, indent=3, ensure_ascii=False)
     messages_formatted = f"<pre>{messages_json}</pre>"
 
@@ -88,7 +93,7 @@ async def cmd_messages(message: types.Message, command: CommandObject):
 @checker
 async def cmd_user(message: types.Message, command: CommandObject):
     """
-    Retrieves and sends the profile information of a specified user to the admin.
+    Retrieves and sends the profile information of a specified user and their last matching result to the admin.
     """
     if not command.args or len(command.args.split()) != 1:
         await send_msg_user(message.from_user.id, "Введи пользователя:\n/user @vbalab")
@@ -97,7 +102,12 @@ async def cmd_user(message: types.Message, command: CommandObject):
     username = command.args.split()[0].replace('@', '').replace(" ", '')
 
     user_id = await find_id_by_username(username)
-    user_info = await find_user(user_id)
+    user_info = await find_user(user_id) if user_id else None
+    if user_info is None:
+        await send_msg_user(message.from_user.id, "Этот пользователь не пользуется ботом. Abort")
+        return
+
+    user_info["last_match"] = await find_last_results(user_id)
 
     user_info = json.dumps(user_info, indent=3, ensure_ascii=False)
 
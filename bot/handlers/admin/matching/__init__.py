@@ -1 +1 @@
-from . import emojis, assignment
\ No newline at end of file
+from . import emojis, engine, result, history, assignment
\ No newline at end of file
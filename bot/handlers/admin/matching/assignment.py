@@ -1,61 +1,147 @@
-import random
-import secrets
-import pandas as pd
-from collections import defaultdict
+import os
+import time
+import asyncio
+import logging
+import multiprocessing
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
 
-from .emojis import distinct_emoji_list
-from db.operations.users import find_all_users
+from .emojis import draw_emojis
+from .history import find_met
+from .result import Matching, MatchedUser
+from .engine import GREEDY, MATCHING_MODES
+from matching_worker import load_engine, solve_matching
+from db.operations.users import find_all_users, ELIGIBLE_USERS
+from handlers.client.commands.start import StartSexChoices
+from handlers.client.commands.survey import N_QUESTIONS
 
 
-def uniform_blacklist_matching(blacklists):
+RESTARTS = 4                                            # independently seeded matchings, the best one is kept
+MATCHING_WORKERS = min(RESTARTS, os.cpu_count() or 1)
+
+matching_pool = None
+
+SEX_CODES = {choice.value: code for code, choice in enumerate(StartSexChoices)}
+NO_SEX = -1
+
+
+def survey_answers(users, survey: str) -> np.ndarray:
+    """
+    Encodes the answers of the given survey as an (n, N_QUESTIONS) int8 matrix. Missing answers count as neutral 0.
+    """
+    answers = [[int(user.get(survey, {}).get(f"question{number}") or 0) for number in range(1, N_QUESTIONS + 1)]
+               for user in users]
+
+    return np.array(answers, dtype=np.int8).reshape(len(users), N_QUESTIONS)
+
+
+def matching_problem(users, met=None):
+    """
+    Encodes users as the plain arrays `solve_matching` works with: blacklists and pairs of users
+    who have already met (a dict of user ID -> IDs) as forbidden pairs of user numbers,
+    sexes as codes and survey answers as matrices.
+    """
+    usernames = [user["info"]["username"] for user in users]
+    username_to_index = {username: i for i, username in enumerate(usernames)}
+    id_to_index = {user["_id"]: i for i, user in enumerate(users)}
+
+    forbidden = [(i, username_to_index[blocked])
+                 for i, user in enumerate(users)
+                 for blocked in user["blacklist"]
+                 if blocked in username_to_index]
+    forbidden += [(i, id_to_index[other])
+                  for i, user in enumerate(users)
+                  for other in (met or {}).get(user["_id"], ())
+                  if other in id_to_index]
+    forbidden_sources, forbidden_targets = zip(*forbidden) if forbidden else ((), ())
+
+    return {
+        "n": len(users),
+        "forbidden_sources": np.array(forbidden_sources, dtype=np.int64),
+        "forbidden_targets": np.array(forbidden_targets, dtype=np.int64),
+        "sex": np.array([SEX_CODES.get(user["info"]["sex"], NO_SEX) for user in users], dtype=np.int8),
+        "partner_sex": np.array([SEX_CODES.get(user["info"]["partner_sex"], NO_SEX) for user in users], dtype=np.int8),
+        "answers": survey_answers(users, "survey"),
+        "partner_answers": survey_answers(users, "partner_survey"),
+    }
+
+
+def start_matching_pool():
+    """
+    Starts the process pool for matching restarts once, at startup. Its workers are spawned rather than forked,
+    so they don't inherit the bot's event loop and threads, and load the engine when they start.
+    Spawned workers import the main module, start_bot.py, which imports the bot only when it is run.
     """
-    Matches users while respecting their blacklists. Each user is matched with up to 2 candidates 
-    who are not in their blacklist and have not exceeded the maximum number of assignments.
+    global matching_pool
+
+    if matching_pool is None:
+        matching_pool = ProcessPoolExecutor(max_workers=MATCHING_WORKERS, mp_context=multiprocessing.get_context("spawn"),
+                                            initializer=load_engine)
+
+    return matching_pool
+
+
+def close_matching_pool():
+    """
+    Shuts the process pool for matching restarts down, if it was started.
+    """
+    global matching_pool
+
+    if matching_pool is not None:
+        matching_pool.shutdown(cancel_futures=True)
+        matching_pool = None
+
+    return
+
+
+async def survey_matching(users, mode: str = GREEDY, restarts: int = RESTARTS, met=None):
+    """
+    Matches users by the compatibility of their surveys: a user's partner survey is compared with the candidates' surveys.
+    Only users whose sex and partner sex fit each other are matched, and blacklists are respected in both directions:
+    a user is never assigned to someone from their blacklist, nor to someone who has them in their blacklist.
+    Users who have already met in previous runs, as given by `met`, are never matched again.
+    Each user is matched with up to 2 candidates, and each candidate is assigned to at most 2 users.
+    Runs `restarts` independently seeded matchings in the process pool, off the event loop, and keeps
+    the one with the most assignments and then the highest score. Seeds are logged, so any run can be reproduced.
+    Returns the usernames assigned to every user, in the order of users, and the stats of the kept solution.
     """
-    max_assignments = 2
-    # max_assignments = (2 * len(users)) // len(users) + 1
-    users = list(blacklists.keys())
-    matched = {user: [] for user in users}
-    assignment_counts = defaultdict(int)                # a dictionary that provides a default value for a non-existent key
+    time_started = time.perf_counter()
 
+    problem = matching_problem(users, met)
+    seeds = np.random.SeedSequence().generate_state(restarts).tolist()
 
-    for user in users:
-        possible_candidates = [u for u in users if u != user and u not in blacklists[user]]
-        random.shuffle(possible_candidates)
+    loop = asyncio.get_running_loop()
+    pool = start_matching_pool()                        # started at startup already, unless the bot wasn't
+    results = await asyncio.gather(*(loop.run_in_executor(pool, solve_matching, problem, mode, seed) for seed in seeds))
 
-        candidates_sorted = sorted(possible_candidates, key=lambda u: assignment_counts[u])
+    for _, restart_stats in results:
+        logging.info(f"process='matching'                        !! Restart {restart_stats}")
 
-        for candidate in candidates_sorted:
-            if len(matched[user]) < 2 and assignment_counts[candidate] < max_assignments:
-                matched[user].append(candidate)
-                assignment_counts[candidate] += 1
+    assignments, stats = max(results, key=lambda result: (result[1]["assignments"], result[1]["score"]))
+    stats["restarts"] = restarts
+    stats["solve_time"] = time.perf_counter() - time_started
 
-                if len(matched[user]) == 2:
-                    break
+    usernames = [user["info"]["username"] for user in users]
+    matched = [[usernames[j] for j in row if j >= 0] for row in assignments]
 
-    return matched
+    return matched, stats
 
 
-async def match():
+async def match(mode: str = GREEDY):
     """
     Retrieves users from the database, filters out users with matching restrictions, 
-    and performs the matching process while respecting blacklists. Attaches random emojis to each match.
+    and matches them by their surveys while respecting sexes, blacklists and previous runs. Attaches a distinct random emoji to each user.
+    Returns the matching and the stats of the solution.
     """
-    users = await find_all_users(["_id", "info", "blacklist", "blocked_bot", "active_matching", "blocked_matching"])
-    users = [user for user in users if user["blocked_bot"] == "no" and user["active_matching"] == "yes" and user["blocked_matching"] == "no"]
-
-    blacklists = {user["info"]["username"]: user["blacklist"] for user in users}
-    matched = uniform_blacklist_matching(blacklists)
-    matched = pd.DataFrame(matched.items(), columns=["username", "assignments"])
+    users = await find_all_users(["_id", "info", "blacklist", "survey", "partner_survey"], ELIGIBLE_USERS)
+    met = await find_met(user["_id"] for user in users)
 
-    emojis = distinct_emoji_list()
-    matched["emoji"] = [secrets.choice(emojis) for _ in range(matched.shape[0])]
+    matched, stats = await survey_matching(users, mode, met=met)
+    logging.info(f"process='matching'                        !! {stats}")
 
-    username_to_id = {user["info"]["username"]: user["_id"] for user in users}
-    username_to_info = {user["info"]["username"]: user["info"] for user in users}
-    matched["_id"] = matched["username"].apply(lambda x: username_to_id[x])
-    matched["info"] = matched["username"].apply(lambda x: username_to_info[x])
+    emojis = draw_emojis(len(users))
 
-    matched = matched.set_index("_id").loc[:, ["username", "emoji", "assignments", "info"]]
+    matched = Matching([MatchedUser(user["_id"], user["info"]["username"], emj, assignments, user["info"])
+                        for user, assignments, emj in zip(users, matched, emojis)])
 
-    return matched
+    return matched, stats
@@ -1,11 +1,16 @@
 import emoji
-import pandas as pd
+import secrets
+import functools
+
+
+system_random = secrets.SystemRandom()
 
 
 def distinct_emoji_list():
     """
     Returns a list of simple, non-complex emojis. 
     Filters out emojis with special characters like skin tone modifiers or those that are composed of multiple code points.
+    Builds the list from scratch, use `emoji_pool` for the cached one.
     """
     def is_simple_emoji(emj):
         """
@@ -32,7 +37,7 @@ def distinct_emoji_list():
         ]
 
         # Check if emoji contains any of the special characters or is a sequence of multiple code points
-        return not any(char in emj for char in special_chars) and len(emj) == len(emj.encode('utf-16', 'surrogatepass').decode('utf-16'))
+        return not any(char in emj for char in special_chars) and len(emj) == 1
 
 
     def is_non_letter_emoji(emj):
@@ -44,7 +49,54 @@ def distinct_emoji_list():
         return not all(ord(char) in regional_indicator_range for char in emj)
 
 
-    emojis = pd.Series(emoji.unicode_codes.EMOJI_DATA.keys()).unique().tolist()
+    emojis = list(dict.fromkeys(emoji.unicode_codes.EMOJI_DATA.keys()))
     emojis = [i for i in emojis if is_simple_emoji(i) and is_non_letter_emoji(i)]
 
     return emojis
+
+
+@functools.cache
+def emoji_pool():
+    """
+    Returns the pool of emojis used as identifiers, built and validated once per process.
+    """
+    pool = tuple(distinct_emoji_list())
+
+    validate_emoji_pool(pool)
+
+    return pool
+
+
+def validate_emoji_pool(pool):
+    """
+    Raises ValueError if the pool can't serve as identifiers: if it is empty, has duplicates,
+    or has emojis that are not a single code point.
+    """
+    if not pool:
+        raise ValueError("Emoji pool is empty.")
+
+    if len(set(pool)) != len(pool):
+        raise ValueError("Emoji pool has duplicates.")
+
+    complex_emojis = [emj for emj in pool if len(emj) != 1]
+    if complex_emojis:
+        raise ValueError(f"Emoji pool has emojis of several code points: {complex_emojis[:10]}")
+
+    return
+
+
+def draw_emojis(n: int):
+    """
+    Returns n distinct emoji identifiers, drawn without replacement in O(n).
+    If there are more users than emojis in the pool, everyone gets a pair of emojis instead.
+    """
+    pool = emoji_pool()
+    size = len(pool)
+
+    if n <= size:
+        return system_random.sample(pool, n)
+
+    if n > size * size:
+        raise ValueError(f"Can't draw {n} distinct emoji identifiers from a pool of {size} emojis.")
+
+    return [pool[code // size] + pool[code % size] for code in system_random.sample(range(size * size), n)]
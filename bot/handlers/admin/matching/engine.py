@@ -0,0 +1,458 @@
+import time
+import numpy as np
+
+
+DEGREE = 2                                              # every user gets up to 2 assignments and is assigned to up to 2 users
+EXHAUSTIVE_PAIRS = 1_000_000                            # short users × open users, below which all their pairs are tried
+FILL_ROUNDS = 32                                        # random rounds for users left short after the scored ones
+CANDIDATES = 8                                          # best scored candidates kept for every user
+CANDIDATE_POOL = 4096                                   # random compatible users searched for candidates of every chunk
+SCORE_CHUNK = 1024                                      # users whose scores are computed at once
+OPTIMAL_CANDIDATES = 32                                 # candidates kept for every user when solving by auction
+AUCTION_EPSILON = 1.0                                   # bid increment, the auction is optimal up to it per assignment
+AUCTION_BUDGET = 60.0                                   # seconds after which the auction gives up
+ANSWER_LEVELS = 5                                       # survey answers are -2..2
+
+GREEDY = "greedy"
+OPTIMAL = "optimal"
+GREEDY_FALLBACK = "greedy (fallback)"
+MATCHING_MODES = (GREEDY, OPTIMAL)
+
+
+class Eligibility:
+    """
+    Describes which user may be assigned to which, for users numbered 0..n-1.
+    Every pair is allowed except a user with themselves and the forbidden pairs.
+    Forbidden pairs are applied in both directions and are stored sparsely as sorted int64 codes `i * n + j`,
+    so memory grows with the number of blacklist entries rather than with n².
+    If `sex` and `partner_sex` codes are given, only mutually compatible users are allowed:
+    each one's sex is the sex the other is looking for.
+    """
+    def __init__(self, n: int, forbidden_sources=(), forbidden_targets=(), sex=None, partner_sex=None) -> None:
+        self.n = n
+
+        sources = np.asarray(forbidden_sources, dtype=np.int64)
+        targets = np.asarray(forbidden_targets, dtype=np.int64)
+
+        self.forbidden = np.unique(np.concatenate([sources * n + targets, targets * n + sources]))
+
+        self.sex = None if sex is None else np.asarray(sex, dtype=np.int8)
+        self.partner_sex = None if partner_sex is None else np.asarray(partner_sex, dtype=np.int8)
+
+    def compatible(self, sources: np.ndarray, targets: np.ndarray) -> np.ndarray:
+        """
+        Returns a boolean array telling for each (source, target) pair whether their sexes fit each other.
+        Arrays are broadcast, so a block of pairs can be checked with `sources[:, None]` and `targets[None, :]`.
+        """
+        if self.sex is None:
+            return np.ones(np.broadcast(sources, targets).shape, dtype=bool)
+
+        return (self.partner_sex[sources] == self.sex[targets]) & (self.partner_sex[targets] == self.sex[sources])
+
+    def groups(self):
+        """
+        Yields (group, targets) index arrays, where the group holds all users with the same sex and partner sex,
+        and targets are all users compatible with them. Without sexes, everyone is one group compatible with everyone.
+        """
+        everyone = np.arange(self.n)
+
+        if self.sex is None:
+            yield everyone, everyone
+            return
+
+        for sex, partner_sex in np.unique(np.stack([self.sex, self.partner_sex], axis=1), axis=0):
+            group = everyone[(self.sex == sex) & (self.partner_sex == partner_sex)]
+            targets = everyone[(self.sex == partner_sex) & (self.partner_sex == sex)]
+
+            yield group, targets
+
+    def compatible_with_any(self, sources: np.ndarray, targets: np.ndarray) -> np.ndarray:
+        """
+        Returns a boolean array telling for each target whether it is compatible with at least one of the sources.
+        Checked once per distinct sex and partner sex of the sources, of which there are only a few.
+        """
+        if self.sex is None:
+            return np.ones(targets.size, dtype=bool)
+
+        found = np.zeros(targets.size, dtype=bool)
+        for sex, partner_sex in np.unique(np.stack([self.sex[sources], self.partner_sex[sources]], axis=1), axis=0):
+            found |= (self.sex[targets] == partner_sex) & (self.partner_sex[targets] == sex)
+
+        return found
+
+    def allowed(self, sources: np.ndarray, targets: np.ndarray) -> np.ndarray:
+        """
+        Returns a boolean array telling for each (source, target) pair whether the target may be assigned to the source.
+        """
+        allowed = (sources != targets) & self.compatible(sources, targets)
+
+        if self.forbidden.size:
+            codes = sources.astype(np.int64) * self.n + targets
+            positions = np.minimum(np.searchsorted(self.forbidden, codes), self.forbidden.size - 1)
+            allowed &= self.forbidden[positions] != codes
+
+        return allowed
+
+
+class Compatibility:
+    """
+    Scores how well a candidate fits a user: the candidate's survey answers are compared with the user's
+    partner survey answers, and the score is the maximum distance minus the L1 distance between them.
+    Answers are encoded as thermometer codes (answer a becomes `ANSWER_LEVELS - 1` bits, the first a + 2 set),
+    so the L1 distance is |x| + |y| - 2 x·y and a whole block of scores is one matrix product.
+    """
+    def __init__(self, answers: np.ndarray, partner_answers: np.ndarray) -> None:
+        self.max_score = (ANSWER_LEVELS - 1) * answers.shape[1]
+
+        self.codes = self.encode(answers)
+        self.partner_codes = self.encode(partner_answers)
+        self.weights = self.codes.sum(axis=1)
+        self.partner_weights = self.partner_codes.sum(axis=1)
+
+    @staticmethod
+    def encode(answers: np.ndarray) -> np.ndarray:
+        """
+        Encodes an (n, questions) matrix of answers -2..2 as an (n, questions * 4) matrix of thermometer bits.
+        """
+        levels = np.arange(ANSWER_LEVELS - 1, dtype=np.int8) - (ANSWER_LEVELS - 1) // 2
+        codes = answers[:, :, None] >= levels + 1
+
+        return codes.reshape(answers.shape[0], answers.shape[1] * (ANSWER_LEVELS - 1)).astype(np.float32)
+
+    def score(self, sources: np.ndarray, targets: np.ndarray) -> np.ndarray:
+        """
+        Returns the scores of the given (source, target) pairs.
+        """
+        products = np.einsum("ij,ij->i", self.partner_codes[sources], self.codes[targets])
+        distances = self.partner_weights[sources] + self.weights[targets] - 2 * products
+
+        return (self.max_score - distances).astype(np.int64)
+
+    def block(self, sources: np.ndarray, targets: np.ndarray) -> np.ndarray:
+        """
+        Returns the (len(sources), len(targets)) matrix of scores of the given users against the given candidates.
+        """
+        distances = self.partner_weights[sources, None] + self.weights[None, targets] \
+                    - 2 * (self.partner_codes[sources] @ self.codes[targets].T)
+
+        return self.max_score - distances
+
+
+def top_candidates(eligibility: Eligibility, compatibility: Compatibility, rng: np.random.Generator,
+                   k: int = CANDIDATES, pool: int = CANDIDATE_POOL, chunk: int = SCORE_CHUNK):
+    """
+    Returns (n, k) arrays with the best scored allowed candidates of every user, best first, and their scores.
+    Missing candidates are padded with -1. Users are scored chunk by chunk against a random sample of `pool` users
+    compatible with them, so the cost grows linearly with n; with 10 answers per survey the best of a few thousand
+    users is as good as the best of everyone. Different chunks see different samples, which also spreads
+    the proposals over more users, and ties are broken at random.
+    """
+    n = eligibility.n
+    candidates = np.full((n, k), -1, dtype=np.int64)
+    candidate_scores = np.full((n, k), -np.inf, dtype=np.float32)
+
+    for group, targets in eligibility.groups():
+        width = min(2 * k, pool, targets.size)          # spare candidates, in case some of the best are blacklisted
+        if width == 0:
+            continue
+
+        for start in range(0, group.size, chunk):
+            sources = group[start:start + chunk]
+            sample = rng.choice(targets, min(pool, targets.size), replace=False)
+
+            scores = compatibility.block(sources, sample)
+            best = np.argpartition(-scores, width - 1, axis=1)[:, :width]
+            best_scores = np.take_along_axis(scores, best, axis=1)
+
+            order = np.argsort(-best_scores, axis=1, kind="stable")
+            best = sample[np.take_along_axis(best, order, axis=1)]
+            best_scores = np.take_along_axis(best_scores, order, axis=1)
+
+            ok = eligibility.allowed(np.repeat(sources, width).reshape(-1, width), best)
+
+            rank = np.cumsum(ok, axis=1) - 1            # position of every allowed candidate among the kept ones
+            rows, columns = np.nonzero(ok & (rank < k))
+            candidates[sources[rows], rank[rows, columns]] = best[rows, columns]
+            candidate_scores[sources[rows], rank[rows, columns]] = best_scores[rows, columns]
+
+    return candidates, candidate_scores
+
+
+def solve_matching(problem: dict, mode: str, seed: int):
+    """
+    Runs one matching of the given problem with its own random generator, so runs with the same seed are identical.
+    The problem holds only plain arrays: `n`, `forbidden_sources`, `forbidden_targets`, `sex`, `partner_sex`,
+    `answers` and `partner_answers`, so it is cheap to send to a worker process.
+    In the OPTIMAL mode the assignments are solved by an auction, falling back to GREEDY if it runs out of time.
+    Returns the (n, DEGREE) assignments and the stats of the solution.
+    """
+    rng = np.random.default_rng(seed)
+    time_started = time.perf_counter()
+
+    eligibility = Eligibility(problem["n"], problem["forbidden_sources"], problem["forbidden_targets"],
+                              problem["sex"], problem["partner_sex"])
+    compatibility = Compatibility(problem["answers"], problem["partner_answers"])
+
+    solver = mode
+    if mode == OPTIMAL:
+        candidates, candidate_scores = top_candidates(eligibility, compatibility, rng, OPTIMAL_CANDIDATES)
+        assignments = auction_matching(eligibility, candidates, candidate_scores, rng)
+
+        if assignments is None:
+            solver = GREEDY_FALLBACK
+            assignments = scored_matching(eligibility, candidates, candidate_scores, rng)
+    else:
+        candidates, candidate_scores = top_candidates(eligibility, compatibility, rng)
+        assignments = scored_matching(eligibility, candidates, candidate_scores, rng)
+
+    sources, slots = np.nonzero(assignments >= 0)
+
+    stats = {
+        "mode": mode,
+        "solver": solver,
+        "seed": seed,
+        "users": problem["n"],
+        "assignments": int(sources.size),
+        "score": int(compatibility.score(sources, assignments[sources, slots]).sum()),
+        "solve_time": time.perf_counter() - time_started,
+    }
+
+    return assignments, stats
+
+
+def scored_matching(eligibility: Eligibility, candidates: np.ndarray, candidate_scores: np.ndarray,
+                    rng: np.random.Generator, degree: int = DEGREE) -> np.ndarray:
+    """
+    Assigns up to `degree` users to every user, preferring their best scored candidates.
+    In round r every user still short of assignments proposes to their r-th candidate; a user who got
+    more proposals than they can take accepts the best scored ones. Users left short afterwards are filled
+    from compatible users that can still take assignments, and then by swapping into existing assignments.
+    Returns an (n, degree) array of assigned users, padded with -1.
+    """
+    n = eligibility.n
+
+    assignments = np.full((n, degree), -1, dtype=np.int64)
+    out_degree = np.zeros(n, dtype=np.int64)
+    in_degree = np.zeros(n, dtype=np.int64)
+
+    for r in range(candidates.shape[1]):
+        sources = np.flatnonzero((out_degree < degree) & (candidates[:, r] >= 0))
+        targets = candidates[sources, r]
+
+        accept_proposals(sources, targets, candidate_scores[sources, r], assignments, out_degree, in_degree, degree)
+
+    fill_short(eligibility, rng, assignments, out_degree, in_degree, degree)
+
+    return assignments
+
+
+def auction_matching(eligibility: Eligibility, candidates: np.ndarray, candidate_scores: np.ndarray,
+                     rng: np.random.Generator, budget: float = AUCTION_BUDGET, epsilon: float = AUCTION_EPSILON,
+                     degree: int = DEGREE):
+    """
+    Assigns up to `degree` users to every user by an auction over the candidate graph, which maximizes
+    the number of assignments and then their total score, up to `epsilon` per assignment.
+    Every user has `degree` slots bidding for the `degree` copies of their candidates. A slot bids for the copy
+    with the best score minus price, raising its price by the gain over the second best plus `epsilon`,
+    and the slot outbid for a copy bids again. Slots of one user never hold copies of the same candidate.
+    All waiting slots bid at once in a round, one slot per user, and only the slots that lost or were outbid
+    wait for the next round. Users left short afterwards are filled as in
+    `scored_matching`. Returns an (n, degree) array of assigned users padded with -1,
+    or None if the auction didn't finish within `budget` seconds.
+    """
+    deadline = time.monotonic() + budget
+    n, k = candidates.shape
+
+    valid = candidates >= 0
+    bonus = candidate_scores[valid].max(initial=0) + 1  # any assignment is worth more than a better score elsewhere
+    copies = np.arange(degree)
+
+    options = (np.maximum(candidates, 0)[:, :, None] * degree + copies).reshape(n, k * degree)
+    values = np.repeat(np.where(valid, candidate_scores + bonus, -np.inf), degree, axis=1)
+
+    prices = np.zeros(n * degree)
+    owner = np.full(n * degree, -1, dtype=np.int64)     # copy -> slot holding it
+    holding = np.full(n * degree, -1, dtype=np.int64)   # slot -> copy it holds
+
+    waiting = np.arange(n * degree)
+    while waiting.size:
+        if time.monotonic() > deadline:
+            return None
+
+        users = waiting // degree
+        first = np.ones(waiting.size, dtype=bool)
+        first[1:] = users[1:] != users[:-1]
+        slots, users, deferred = waiting[first], users[first], waiting[~first]
+
+        objects = options[users]
+        gains = values[users] - prices[objects]
+
+        held = holding[users[:, None] * degree + copies]
+        held_users = np.where(held >= 0, held // degree, -1)
+        gains[(objects[:, :, None] // degree == held_users[:, None, :]).any(axis=2)] = -np.inf
+
+        rows = np.arange(slots.size)
+        best = np.argmax(gains, axis=1)
+        best_gain = gains[rows, best]
+        gains[rows, best] = -np.inf
+        second_gain = np.maximum(gains.max(axis=1), 0)
+
+        bid = best_gain > 0                             # prices only grow, so other slots would never get anything
+        slots, objects = slots[bid], objects[rows[bid], best[bid]]
+        bids = prices[objects] + best_gain[bid] - second_gain[bid] + epsilon
+
+        order = np.lexsort((-bids, objects))
+        slots, objects, bids = slots[order], objects[order], bids[order]
+        won = np.ones(objects.size, dtype=bool)
+        won[1:] = objects[1:] != objects[:-1]
+
+        outbid = owner[objects[won]]
+        outbid = outbid[outbid >= 0]
+        holding[outbid] = -1
+
+        owner[objects[won]] = slots[won]
+        holding[slots[won]] = objects[won]
+        prices[objects[won]] = bids[won]
+
+        waiting = np.unique(np.concatenate([deferred, slots[~won], outbid]))
+
+    assignments = np.where(holding >= 0, holding // degree, -1).reshape(n, degree)
+    assignments = -np.sort(-assignments, axis=1)        # assigned users first, -1 after them
+
+    out_degree = (assignments >= 0).sum(axis=1)
+    in_degree = np.bincount(assignments[assignments >= 0], minlength=n)
+
+    fill_short(eligibility, rng, assignments, out_degree, in_degree, degree)
+
+    return assignments
+
+
+def fill_short(eligibility, rng, assignments, out_degree, in_degree, degree=DEGREE):
+    """
+    Gives users who are still short of assignments what's left: from random compatible users in rounds,
+    then from all compatible users that can still take assignments, and then by swapping into existing assignments.
+    """
+    fill_randomly(eligibility, rng, assignments, out_degree, in_degree, degree)
+
+    short = np.flatnonzero(out_degree < degree)
+    open_targets = np.flatnonzero(in_degree < degree)
+    if short.size and open_targets.size:
+        fill_exhaustively(eligibility, short, open_targets, assignments, out_degree, in_degree, degree)
+        fill_by_swaps(eligibility, short, assignments, out_degree, in_degree, degree)
+
+    return
+
+
+def accept_proposals(sources, targets, priorities, assignments, out_degree, in_degree, degree=DEGREE):
+    """
+    Records the proposals source -> target, at most one per source. A target that got more proposals
+    than it can take accepts the ones with the highest priority.
+    """
+    order = np.lexsort((-priorities, targets))
+    sources, targets = sources[order], targets[order]
+
+    first = np.ones(targets.size, dtype=bool)
+    first[1:] = targets[1:] != targets[:-1]
+    positions = np.arange(targets.size)
+    rank = positions - np.maximum.accumulate(np.where(first, positions, 0))
+
+    ok = in_degree[targets] + rank < degree
+    sources, targets = sources[ok], targets[ok]
+
+    assignments[sources, out_degree[sources]] = targets
+    out_degree[sources] += 1
+    in_degree += np.bincount(targets, minlength=in_degree.size)  # a target may accept several proposals at once
+
+    return
+
+
+def fill_randomly(eligibility, rng, assignments, out_degree, in_degree, degree=DEGREE, rounds=FILL_ROUNDS):
+    """
+    Gives short users assignments from random compatible users that can still take them, in vectorized rounds,
+    until few enough of them are left to be tried exhaustively.
+    """
+    for group, targets in eligibility.groups():
+        for _ in range(rounds):
+            sources = group[out_degree[group] < degree]
+            open_targets = targets[in_degree[targets] < degree]
+            if sources.size * open_targets.size <= EXHAUSTIVE_PAIRS:
+                break
+
+            proposed = open_targets[rng.integers(open_targets.size, size=sources.size)]
+
+            ok = eligibility.allowed(sources, proposed) & ~(assignments[sources] == proposed[:, None]).any(axis=1)
+            sources, proposed = sources[ok], proposed[ok]
+
+            accept_proposals(sources, proposed, np.zeros(sources.size), assignments, out_degree, in_degree, degree)
+
+    return
+
+
+def fill_exhaustively(eligibility, sources, open_targets, assignments, out_degree, in_degree, degree=DEGREE):
+    """
+    Gives each of the short users assignments from all compatible users that can still take them, one user at a time.
+    """
+    for group, targets in eligibility.groups():
+        group_sources = sources[np.isin(sources, group)]
+        group_targets = open_targets[np.isin(open_targets, targets)]
+
+        for source in group_sources:
+            group_targets = group_targets[in_degree[group_targets] < degree]
+            if group_targets.size == 0:
+                break
+
+            candidates = group_targets[eligibility.allowed(np.full(group_targets.size, source), group_targets)]
+            candidates = candidates[~np.isin(candidates, assignments[source])]
+
+            for target in candidates[:degree - out_degree[source]]:
+                assignments[source, out_degree[source]] = target
+                out_degree[source] += 1
+                in_degree[target] += 1
+
+    return
+
+
+def fill_by_swaps(eligibility, sources, assignments, out_degree, in_degree, degree=DEGREE):
+    """
+    Gives short users assignments when every user allowed for them is full. For a short `source` and a user `open`
+    who can still take an assignment, an assignment a -> b is replaced by a -> open and source -> b,
+    which keeps everyone's degrees within the limits.
+    Short users who can't get anything by a swap because of their sex are skipped up front.
+    """
+    holders, slots = np.nonzero(assignments >= 0)
+    takes_open = eligibility.compatible_with_any(np.flatnonzero(in_degree < degree), holders)
+    sources = sources[eligibility.compatible_with_any(assignments[holders[takes_open], slots[takes_open]], sources)]
+
+    for source in sources:
+        while out_degree[source] < degree:
+            holders, slots = np.nonzero(assignments >= 0)
+            targets = assignments[holders, slots]
+
+            fits_source = (targets != source) & eligibility.allowed(np.full(targets.size, source), targets) \
+                                              & ~np.isin(targets, assignments[source])
+            if not fits_source.any():
+                break
+
+            open_targets = np.flatnonzero(in_degree < degree)
+            open_targets = open_targets[eligibility.compatible_with_any(holders[fits_source], open_targets)]
+
+            swap = None
+            for open_target in open_targets:
+                ok = fits_source & eligibility.allowed(holders, np.full(holders.size, open_target)) \
+                                 & ~(assignments[holders] == open_target).any(axis=1)
+                if ok.any():
+                    swap = np.flatnonzero(ok)[0], open_target
+                    break
+
+            if swap is None:
+                break
+
+            (edge, open_target) = swap
+            holder, slot, target = holders[edge], slots[edge], targets[edge]
+
+            assignments[holder, slot] = open_target
+            assignments[source, out_degree[source]] = target
+            out_degree[source] += 1
+            in_degree[open_target] += 1
+
+    return
@@ -0,0 +1,77 @@
+import logging
+from pymongo import UpdateOne
+
+from db.connect import get_mongo_matches, get_mongo_met
+from handlers.admin.matching.save import find_run_results
+
+
+def met_pairs(entries):
+    """
+    Collects who met whom in one matching run from its (user_id, username, assignments) entries.
+    Assignments are usernames, resolved to IDs within the same run. Meeting is mutual, so pairs are added both ways.
+    Returns a dict of user ID -> set of IDs of the users they met.
+    """
+    entries = list(entries)
+    username_to_id = {username: user_id for user_id, username, _ in entries}
+
+    met = {}
+    for user_id, _, assignments in entries:
+        for username in assignments:
+            other = username_to_id.get(username)
+            if other is None:
+                continue
+
+            met.setdefault(user_id, set()).add(other)
+            met.setdefault(other, set()).add(user_id)
+
+    return met
+
+
+async def index_matching_run(run_id: str, entries):
+    """
+    Adds the pairs of one matching run to the 'met' index, which holds one document per user
+    with the IDs of everyone they have met: {"_id": user_id, "met": [user_id, ...]}.
+    Adding is idempotent, and the run is marked as indexed, so it is never read again.
+    """
+    mongo_matches = get_mongo_matches()
+    mongo_met = get_mongo_met()
+
+    met = met_pairs(entries)
+
+    if met:
+        await mongo_met.bulk_write([UpdateOne({"_id": user_id}, {"$addToSet": {"met": {"$each": sorted(others)}}}, upsert=True)
+                                    for user_id, others in met.items()], ordered=False)
+
+    await mongo_matches.update_one({"_id": run_id}, {"$set": {"indexed": True}})
+
+    logging.info(f"process='met index'                       !! Run {run_id} was indexed for {len(met)} users.")
+
+    return
+
+
+async def sync_met_index():
+    """
+    Adds the matching runs that are not in the 'met' index yet, e.g. the ones saved before it existed.
+    Runs are read one at a time.
+    """
+    mongo_matches = get_mongo_matches()
+
+    run_ids = [run["_id"] async for run in mongo_matches.find({"indexed": {"$ne": True}}, {"_id": 1})]
+
+    for run_id in run_ids:
+        await index_matching_run(run_id, [entry async for entry in find_run_results(run_id)])
+
+    return
+
+
+async def find_met(user_ids):
+    """
+    Returns a dict of user ID -> list of IDs of the users they have met in previous runs, for the given users.
+    """
+    mongo_met = get_mongo_met()
+
+    met = {}
+    async for user in mongo_met.find({"_id": {"$in": list(user_ids)}}):
+        met[user["_id"]] = user["met"]
+
+    return met
@@ -0,0 +1,46 @@
+class MatchedUser:
+    """
+    Matching result of one user: their emoji, the usernames of the users assigned to them and their profile info.
+    """
+    __slots__ = ("user_id", "username", "emoji", "assignments", "info")
+
+    def __init__(self, user_id: int, username: str, emoji: str, assignments: list, info: dict) -> None:
+        self.user_id = user_id
+        self.username = username
+        self.emoji = emoji
+        self.assignments = assignments
+        self.info = info
+
+    def to_dict(self):
+        """
+        Returns the result without the profile info, as it is shown to admins.
+        """
+        return {"username": self.username, "emoji": self.emoji, "assignments": self.assignments}
+
+
+class Matching:
+    """
+    Results of a matching run in the order of users, with direct maps from user ID and from username to the result,
+    so looking up an assigned user is O(1) and walking the whole run is O(n).
+    """
+    __slots__ = ("results", "by_id", "by_username")
+
+    def __init__(self, results: list) -> None:
+        self.results = results
+        self.by_id = {result.user_id: result for result in results}
+        self.by_username = {result.username: result for result in results}
+
+    def __len__(self):
+        return len(self.results)
+
+    def __iter__(self):
+        return iter(self.results)
+
+    def __getitem__(self, user_id):
+        return self.by_id[user_id]
+
+    def to_dict(self):
+        """
+        Returns the results by user ID without profile infos, as they are shown to admins.
+        """
+        return {str(result.user_id): result.to_dict() for result in self.results}
@@ -1,19 +1,74 @@
-import pandas as pd
+from itertools import islice
+from pymongo import DESCENDING
+from pymongo.errors import BulkWriteError
 
-from db.connect import get_mongo_matches
+from .result import Matching
+from db.connect import get_mongo_matches, get_mongo_match_results
 
 
-async def save_matching(matched_df: pd.DataFrame, time_started: str):
+SAVE_BATCH = 1000                                       # per-user results written with one insert_many
+
+
+async def save_matching(matched: Matching, time_started: str, stats: dict = None):
     """
-    Saves the matching results to the MongoDB 'matches' collection. 
-    The results are stored as a dictionary, with the match timestamp as the document ID.
+    Saves the matching results to MongoDB. The run is stored as a small header in the 'matches' collection,
+    with the match timestamp as the document ID, and every user's result is a separate document
+    in the 'match_results' collection, keyed by (run, user) and written in batches.
+    Results that are already saved are left untouched, so saving a run twice is safe.
     """
     mongo_matches = get_mongo_matches()
+    mongo_match_results = get_mongo_match_results()
 
-    matched_df = matched_df.copy()
-    matched_df.index = matched_df.index.astype(str)
-    matched_dict = matched_df.T.to_dict('dict')
+    await mongo_matches.update_one({"_id": time_started},
+                                   {"$setOnInsert": {"users": len(matched), "stats": stats or {}}},
+                                   upsert=True)
 
-    await mongo_matches.insert_one({"_id": time_started, "matching": matched_dict})
+    results = (
+        {
+            "_id": f"{time_started}:{result.user_id}",
+            "run_id": time_started,
+            "user_id": result.user_id,
+            **result.to_dict(),
+        }
+        for result in matched
+    )
+
+    while batch := list(islice(results, SAVE_BATCH)):
+        try:
+            await mongo_match_results.insert_many(batch, ordered=False)
+        except BulkWriteError as e:
+            if any(error["code"] != 11000 for error in e.details["writeErrors"]):       # 11000 - duplicate key
+                raise
 
     return
+
+
+async def find_run_results(run_id: str):
+    """
+    Yields the (user_id, username, assignments) results of one run, reading them in batches.
+    Runs saved before results were stored per user are read from their single 'matches' document.
+    """
+    mongo_matches = get_mongo_matches()
+    mongo_match_results = get_mongo_match_results()
+
+    run = await mongo_matches.find_one({"_id": run_id, "matching": {"$exists": True}}, {"matching": 1})
+    if run is not None:
+        for user_id, result in run["matching"].items():
+            yield int(user_id), result["username"], result["assignments"]
+        return
+
+    results_cursor = mongo_match_results.find({"run_id": run_id}, {"user_id": 1, "username": 1, "assignments": 1})
+    async for result in results_cursor.batch_size(SAVE_BATCH):
+        yield result["user_id"], result["username"], result["assignments"]
+
+
+async def find_last_results(user_id: int, n_runs: int = 1):
+    """
+    Returns the user's results of their last `n_runs` matching runs, latest first.
+    """
+    mongo_match_results = get_mongo_match_results()
+
+    results_cursor = mongo_match_results.find({"user_id": user_id}, {"_id": 0, "user_id": 0})
+    results_cursor = results_cursor.sort("run_id", DESCENDING).limit(n_runs)
+
+    return [result async for result in results_cursor]
@@ -1,26 +1,49 @@
 import json
+import asyncio
 import logging
-import pandas as pd
 from aiogram import exceptions
+from pymongo.errors import BulkWriteError
 
 from create_bot import bot
+from .result import Matching
+from db.connect import get_mongo_outbox
 from configs.selected_ids import ADMINS
 from db.operations.messages import send_msg_user
+from db.operations.utils.session import current_session
 from handlers.admin.commands.non_interactive import send_temporary_file
+from handlers.admin.broadcast import send_limited, background_tasks, SENT, BLOCKED
 
 
-async def send_matching_admin(matched: pd.DataFrame):
+OUTBOX_WORKERS = 16
+OUTBOX_ATTEMPTS = 4                                     # deliveries of a run, failed entries are retried by the next one
+OUTBOX_BACKOFF = 60                                     # seconds before the first retry, doubled for every next one
+
+
+def matching_summary(stats: dict):
+    """
+    Formats the stats of the matching solution for admins.
     """
-    Sends the matching results to all admins. If the message content is too long, 
-    it sends it as a temporary file.
+    return (f"Режим: {stats['mode']}, решено: {stats['solver']}\n"
+            f"Лучший из {stats['restarts']} запусков, seed: {stats['seed']}\n"
+            f"Пользователей: {stats['users']}, назначений: {stats['assignments']}\n"
+            f"Суммарный балл: {stats['score']}\n"
+            f"Время решения: {stats['solve_time']:.2f} с")
+
+
+async def send_matching_admin(matched: Matching, stats: dict = None):
     """
-    matched_formatted = matched.drop(["info"], axis=1).T.to_dict('dict')
+    Sends the matching results to all admins, preceded by the stats of the solution if given.
+    If the message content is too long, it sends it as a temporary file.
+    """
+    matched_formatted = matched.to_dict()
     matched_formatted = json.dumps(matched_formatted, indent=3, ensure_ascii=False)
     matched_formatted = f"<pre>{matched_formatted}</pre>"
 
     for admin in ADMINS:
         try:
-                
+            if stats is not None:
+                await bot.send_message(admin, matching_summary(stats))
+
             if len(matched_formatted) > 4000:
                 await send_temporary_file(admin, matched_formatted)
             else:
@@ -30,54 +53,205 @@ async def send_matching_admin(matched: pd.DataFrame):
     return
 
 
-async def send_matching_client(matched: pd.DataFrame):
+def matching_client_messages(matched: Matching, user_id):
     """
-    Sends the matching results to each user, providing information on who they were matched with, 
+    Builds the messages with the matching results for one user: who they were matched with,
     along with their respective emoji identifiers. If no matches are found, the user is notified.
     """
     def info_by_username(username):
         """
         Formats the information of the matched user to be sent to the client.
         """
-        nonlocal matched
+        row = matched.by_username[username]
 
-        row = matched.loc[matched["username"] == username].iloc[0]
+        return f"{row.info['written_name']} (@{row.username}) с {row.info['program']['name']}'{row.info['program']['year']}.\nСмайл пользователя - {row.emoji}\n\nО себе: {row.info['about']}"
 
-        return f"{row['info']['written_name']} (@{row['username']}) с {row['info']['program']['name']}'{row['info']['program']['year']}.\nСмайл пользователя - {row['emoji']}\n\nО себе: {row['info']['about']}"
 
+    messages = [f"Привет! Пришли с результатами\n\nТвой смайл - {matched[user_id].emoji}"]
 
-    for user_id in matched.index:
-        await send_msg_user(user_id, 
-                            f"Привет! Пришли с результатами\n\nТвой смайл - {matched.loc[user_id, 'emoji']}")
+    assignments = matched[user_id].assignments
+    n = len(assignments)
 
-        assignments = matched.loc[user_id, 'assignments']
-        n = len(assignments)
+    if n == 0:
+        messages.append(f"В этот раз тебе не досталось тех, кому можно написать.\nВозможно, это потому что у тебя слишком много людей в черном списке.\n\nВерни кого-нибудь из него и в следующий раз шанс кого-нибудь получить будет больше")
+    elif n == 1:
+        messages.append(f"В этот раз тебе выпал только один человек, которому ты можешь написать:")
+        messages.append(info_by_username(assignments[0]))
+        messages.append("Ты можешь написать ему его смайл. Он сразу поймет, что выпал тебе на кофе)")
+    elif n == 2:
+        messages.append(info_by_username(assignments[0]))
+        messages.append(info_by_username(assignments[1]))
+        messages.append(f"Ты можешь написать им их смайл. Они сразу поймут, что выпали тебе на кофе)")
+    else:
+        raise ValueError(f"_id='{user_id}' has more than 2 assignments.")
 
-        if n == 0:
-            await send_msg_user(user_id,
-                                f"В этот раз тебе не досталось тех, кому можно написать.\nВозможно, это потому что у тебя слишком много людей в черном списке.\n\nВерни кого-нибудь из него и в следующий раз шанс кого-нибудь получить будет больше")
-        elif n == 1:
-            await send_msg_user(user_id,
-                                f"В этот раз тебе выпал только один человек, которому ты можешь написать:")
+    messages.append(f"Напомним, что распределение участников асимметричное.\nТо есть, те люди, которые выпали тебе, скорее всего не получили тебя")
 
-            await send_msg_user(user_id,
-                                info_by_username(assignments[0]))
+    return messages
 
-            await send_msg_user(user_id, 
-                                "Ты можешь написать ему его смайл. Он сразу поймет, что выпал тебе на кофе)")
-        elif n == 2:
-            await send_msg_user(user_id,
-                                info_by_username(assignments[0]))
 
-            await send_msg_user(user_id,
-                                info_by_username(assignments[1]))
+async def enqueue_matching_client(matched: Matching, run_id: str):
+    """
+    Writes the matching results of every user to the MongoDB 'outbox' collection, one entry per (run, user).
+    Entries that are already in the outbox are left untouched, so enqueueing a run twice is safe.
+    """
+    mongo_outbox = get_mongo_outbox()
 
-            await send_msg_user(user_id,
-                                f"Ты можешь написать им их смайл. Они сразу поймут, что выпали тебе на кофе)")
+    entries = [
+        {
+            "_id": f"{run_id}:{user_id}",
+            "run_id": run_id,
+            "user_id": user_id,
+            "messages": matching_client_messages(matched, user_id),
+            "delivered": 0,                                 # number of messages already sent
+            "done": False,
+        }
+        for user_id in matched.by_id
+    ]
+
+    if not entries:
+        return
+
+    try:
+        await mongo_outbox.insert_many(entries, ordered=False)
+    except BulkWriteError as e:
+        if any(error["code"] != 11000 for error in e.details["writeErrors"]):       # 11000 - duplicate key
+            raise
+
+    return
+
+
+async def deliver_outbox_entry(entry: dict):
+    """
+    Sends the remaining messages of an outbox entry in order, recording each delivered message.
+    Stops at the first failed message, leaving the entry pending for the next delivery.
+    Delivery is at least once: a message is recorded after it is sent, so if the bot stops between the two,
+    that one message is sent again on resume.
+    """
+    mongo_outbox = get_mongo_outbox()
+
+    messages = entry["messages"]
+
+    for i in range(entry["delivered"], len(messages)):
+        outcome = await send_limited(entry["user_id"], messages[i])
+
+        if outcome == SENT:
+            await mongo_outbox.update_one({"_id": entry["_id"]},
+                                          {"$set": {"delivered": i + 1, "done": i + 1 == len(messages)}})
+        elif outcome == BLOCKED:
+            await mongo_outbox.update_one({"_id": entry["_id"]},
+                                          {"$set": {"done": True, "blocked": True}})
+            return
         else:
-            raise ValueError(f"_id='{user_id}' has more than 2 assignments.")
+            return
+
+    return
+
+
+async def deliver_outbox(run_id: str = None, workers: int = OUTBOX_WORKERS):
+    """
+    Delivers all pending outbox entries (of the given run, if provided) with a pool of concurrent senders.
+    Returns the number of entries that are still pending.
+    """
+    mongo_outbox = get_mongo_outbox()
+
+    query = {"done": False}
+    if run_id is not None:
+        query["run_id"] = run_id
+
+    entries = await mongo_outbox.find(query).to_list(length=None)
+
+    queue = asyncio.Queue()
+    for entry in entries:
+        queue.put_nowait(entry)
+
+    async def worker():
+        while not queue.empty():
+            entry = queue.get_nowait()
+
+            try:
+                await deliver_outbox_entry(entry)
+            except Exception:                           # the entry stays pending for the next attempt
+                logging.exception(f"\nERROR: [Error delivering outbox entry {entry['_id']}]\nTRACEBACK:")
+
+    await asyncio.gather(*(worker() for _ in range(min(workers, len(entries)))))
+
+    pending = await mongo_outbox.count_documents(query)
+    logging.info(f"process='matching outbox'                 !! {len(entries)} entries were processed, {pending} are still pending.")
 
-        await send_msg_user(user_id,
-                            f"Напомним, что распределение участников асимметричное.\nТо есть, те люди, которые выпали тебе, скорее всего не получили тебя")
+    return pending
+
+
+async def deliver_outbox_with_retries(run_id: str = None, attempts: int = OUTBOX_ATTEMPTS, backoff: float = OUTBOX_BACKOFF):
+    """
+    Delivers pending outbox entries, retrying the failed ones with exponential backoff.
+    Returns the number of entries that are still pending.
+    """
+    current_session.set(None)                           # the task must not use the session of the admin's update
+
+    pending = await deliver_outbox(run_id)
+
+    for attempt in range(1, attempts):
+        if not pending:
+            break
+
+        await asyncio.sleep(backoff * 2 ** (attempt - 1))
+        pending = await deliver_outbox(run_id)
+
+    return pending
+
+
+async def delivery_summary(run_id: str):
+    """
+    Counts the outcomes of the delivery of a run and formats them for admins.
+    """
+    mongo_outbox = get_mongo_outbox()
+
+    total = await mongo_outbox.count_documents({"run_id": run_id})
+    blocked = await mongo_outbox.count_documents({"run_id": run_id, "blocked": True})
+    failed = await mongo_outbox.count_documents({"run_id": run_id, "done": False})
+
+    return (f"Результаты мэтчинга {run_id} разосланы\n\n"
+            f"Доставлено: {total - blocked - failed}/{total}\n"
+            f"Заблокировали бота: {blocked}\n"
+            f"Не доставлено: {failed}")
+
+
+async def deliver_and_report(admin_id: int, run_id: str):
+    """
+    Delivers the results of a run and sends the admin who started it the outcome of the delivery.
+    """
+    await deliver_outbox_with_retries(run_id)
+
+    await send_msg_user(admin_id, await delivery_summary(run_id))
 
     return
+
+
+async def send_matching_client(matched: Matching, run_id: str, admin_id: int):
+    """
+    Writes the matching results of each user to the outbox and delivers them in the background, so the admin's
+    update handling isn't blocked for the whole delivery. The outbox lets an interrupted delivery be resumed
+    with `resume_matching_client`, resending at most the one message in flight per user. The admin gets a report
+    when delivery ends.
+    """
+    await enqueue_matching_client(matched, run_id)
+
+    task = asyncio.create_task(deliver_and_report(admin_id, run_id))
+
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+
+    return task
+
+
+def resume_matching_client():
+    """
+    Starts delivering outbox entries left pending by a previous run of the bot in the background.
+    """
+    task = asyncio.create_task(deliver_outbox_with_retries())
+
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+
+    return task
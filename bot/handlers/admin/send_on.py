@@ -5,7 +5,7 @@ from create_bot import bot
 from configs.logs import logs_path
 from configs.selected_ids import ADMINS
 from db.operations.messages import send_msg_user
-from db.operations.utils.conversion import user_conversion
+from db.operations.utils.conversion import user_log
 from db.operations.utils.mongo_errors import MongoDBUserNotFound
 
 
@@ -18,8 +18,7 @@ async def send_to_admins(text: str, doc=None):
                 await send_msg_user(admin_id, text)
 
         except exceptions.TelegramBadRequest:
-                admin = await user_conversion.get(admin_id)
-                logging.error(f"Failed to send message to {admin}: {text}")
+                user_log.error("Failed to send message: %s", text, user_id=admin_id)
 
         except MongoDBUserNotFound:
                 logging.error(f"Failed to send message to {admin_id}: {text}")
@@ -118,7 +118,8 @@ async def start_email_get(message: types.Message, state: FSMContext):
         await update_user(message.from_user.id,
                           {"cache.email": message.text, "cache.email_code": code})
 
-        await send_email(message.text, f"Еще раз привет!\nТвой код для NEScafeBot: {code}.\nКод был отправлен для аккаунта @{message.from_user.username}")
+        await send_email(message.text, f"Еще раз привет!\nТвой код для NEScafeBot: {code}.\nКод был отправлен для аккаунта @{message.from_user.username}",
+                         user_id=message.from_user.id)
 
         await send_msg_user(message.from_user.id, 
                             "Мы отправили тебе на почту код из 6 цифр.\nПожалуйста, введи его сюда")
@@ -1,14 +1,31 @@
+import time
+import random
+import asyncio
 import logging
 import aiosmtplib
-from random import choice
 from email.message import EmailMessage
-from aiosmtplib.errors import SMTPAuthenticationError
+from aiosmtplib.errors import SMTPAuthenticationError, SMTPRecipientsRefused, SMTPException
 
 from create_bot import bot
 from configs.env_reader import config
+from db.operations.messages import send_msg_user
 from handlers.admin.send_on import send_to_admins
 
 
+SMTP_HOSTNAME = "smtp.gmail.com"
+SMTP_PORT = 587
+SMTP_TIMEOUT = 30
+EMAIL_WORKERS = 4
+CONNECTIONS_PER_ACCOUNT = 2
+SEND_ATTEMPTS = 3
+KEEPALIVE_INTERVAL = 60                                 # idle seconds after which a connection is checked with NOOP
+PROBE_TIMEOUT = 20
+HEALTH_DECAY = 0.8                                      # weight of the previous health in the moving average
+MIN_HEALTH = 0.05
+
+background_tasks = set()
+
+
 emails = [
     {
         "email": "nes.cafe.user1@gmail.com",
@@ -33,80 +50,331 @@ emails = [
 ]
 
 
-async def send_email(email_to, text):
+class SenderAccount:
     """
-    Sends an email with a verification code to the specified email address.
-    If the email sender fails, it retries with another email account.
+    Sender account with its pool of up to `max_connections` logged in SMTP connections.
+    Health is a moving average of send outcomes from 0 to 1. An account that failed to log in isn't working
+    and is not used at all.
     """
-    global emails
+    def __init__(self, email: str, password: str, max_connections: int = CONNECTIONS_PER_ACCOUNT) -> None:
+        self.email = email
+        self.password = password
 
-    try:
-        email_sender = choice(emails)
-
-        message = EmailMessage()
-        message["Subject"] = "Код подтверждения (ValentiNES)"
-        message["From"] = email_sender["email"]
-        message["To"] = email_to
-        message.set_content(text)
-
-
-        await aiosmtplib.send(
-            message,
-            username=email_sender["email"],
-            password=email_sender["password"],
-            hostname="smtp.gmail.com",
-            port=587,
-            start_tls=True,
-        )
-    except SMTPAuthenticationError:
-        logging.warning(f"process='email send'                      !! Email \"{email_sender['email']}\" is not working. Was trying to send email to {email_to}.")
+        self.slots = asyncio.Semaphore(max_connections)
+        self.idle = []                                  # (connection, time it was last used)
+        self.in_flight = 0
 
-        await send_to_admins(f"WARNING: Email \"{email_sender['email']}\" is not working")
+        self.health = 1.0
+        self.working = True
 
-        await send_email(email_to, text)
+    def load(self):
+        """
+        Returns the load of the account relative to its health; emails go to the account with the lowest load.
+        """
+        return (self.in_flight + 1) / max(self.health, MIN_HEALTH)
 
-    return
+    def record(self, ok: bool):
+        """
+        Updates the health with the outcome of a send.
+        """
+        self.health = HEALTH_DECAY * self.health + (1 - HEALTH_DECAY) * ok
 
+        return
 
-async def test_emails():
+
+class EmailSender:
     """
-    Tests all configured email accounts to ensure they are working. 
-    Removes non-working email accounts from the list.
+    Sends emails from several accounts through long-lived logged in SMTP connections.
+    Emails are queued and sent by `workers` background tasks, so callers don't wait for SMTP.
+    Every attempt goes from the working account with the lowest load, failed attempts are retried
+    up to `attempts` times in total. Connections idle for `keepalive` seconds are checked with NOOP
+    before use and reopened if the server has dropped them.
     """
-    global emails
-    
-    logging.info("### Checking emails ... ###")
+    def __init__(self, accounts: list, hostname: str = SMTP_HOSTNAME, port: int = SMTP_PORT, start_tls: bool = True,
+                 workers: int = EMAIL_WORKERS, attempts: int = SEND_ATTEMPTS, keepalive: float = KEEPALIVE_INTERVAL,
+                 max_size: int = 1000) -> None:
+        self.accounts = [SenderAccount(account["email"], account["password"]) for account in accounts]
+        self.hostname = hostname
+        self.port = port
+        self.start_tls = start_tls
 
-    failed_emails = []
+        self.workers = workers
+        self.attempts = attempts
+        self.keepalive = keepalive
+        self.max_size = max_size
+
+        self.queue = None
+        self.tasks = []
+
+    async def start(self):
+        """
+        Starts the background tasks that send queued emails.
+        """
+        self.queue = asyncio.Queue(maxsize=self.max_size)
+        self.tasks = [asyncio.create_task(self._run()) for _ in range(self.workers)]
+
+        logging.info("### Email sender has started working! ###")
+
+        return
+
+    async def put(self, email_to: str, text: str, user_id: int = None):
+        """
+        Queues an email for sending. Sends it directly if the sender is not running.
+        """
+        if not self.tasks:
+            await self.send(email_to, text, user_id)
+            return
+
+        await self.queue.put((email_to, text, user_id))
+
+        return
+
+    async def stop(self):
+        """
+        Sends all queued emails, stops the background tasks and closes the connections.
+        """
+        if not self.tasks:
+            return
+
+        for _ in self.tasks:
+            await self.queue.put(None)
+        await asyncio.gather(*self.tasks)
+
+        self.tasks = []
+
+        for account in self.accounts:
+            while account.idle:
+                connection, _ = account.idle.pop()
+                await self._close(connection)
+
+        logging.info("### Email sender has finished working! ###")
+
+        return
+
+    async def _run(self):
+        """
+        Sends queued emails until the stop sentinel is received. An error with one email doesn't stop the task.
+        """
+        while True:
+            job = await self.queue.get()
+            if job is None:
+                return
+
+            try:
+                await self.send(*job)
+            except Exception:
+                logging.exception(f"\nERROR: [Error sending email to {job[0]}]\nTRACEBACK:")
+
+    def pick_account(self):
+        """
+        Returns the working account with the lowest load, or None if no account is working.
+        """
+        working = [account for account in self.accounts if account.working]
+        if not working:
+            return None
+
+        random.shuffle(working)                         # spreads ties between accounts
+
+        return min(working, key=SenderAccount.load)
+
+    async def send(self, email_to: str, text: str, user_id: int = None):
+        """
+        Sends an email, retrying with the least loaded accounts. Returns whether it was sent.
+        If it wasn't and `user_id` is given, the user is told so.
+        """
+        for _ in range(self.attempts):
+            account = self.pick_account()
+            if account is None:
+                logging.error(f"process='email send'                      !! No email account is working.")
+                break
 
-    for email_sender in emails:
-        try:
             message = EmailMessage()
-            message["Subject"] = "Проверка работоспособности (ValentiNES)"
-            message["From"] = email_sender["email"]
-            message["To"] = "vbalabaev@nes.ru"
-            message.set_content("Почта работает.")
+            message["Subject"] = "Код подтверждения (ValentiNES)"
+            message["From"] = account.email
+            message["To"] = email_to
+            message.set_content(text)
+
+            try:
+                await self.send_from(account, message)
+                return True
+
+            except SMTPRecipientsRefused:
+                logging.warning(f"process='email send'                      !! Address {email_to} was refused.")
+                break
+
+            except SMTPAuthenticationError:
+                if account.working:                     # concurrent sends may fail on the same account
+                    account.working = False
+                    logging.warning(f"process='email send'                      !! Email \"{account.email}\" is not working. Was trying to send email to {email_to}.")
+
+                    await send_to_admins(f"WARNING: Email \"{account.email}\" is not working")
+
+            except (SMTPException, OSError, asyncio.TimeoutError):
+                logging.exception(f"\nERROR: [Error sending email from {account.email} to {email_to}]\nTRACEBACK:")
+
+        if user_id is not None:
+            try:
+                await send_msg_user(user_id,
+                                    "Не получилось отправить письмо с кодом 😕\n\nНажми /cancel и попробуй еще раз через /start",
+                                    fail=True)
+            except Exception:
+                logging.exception(f"\nERROR: [Error notifying user {user_id} about the failed email]\nTRACEBACK:")
+
+        return False
+
+    async def send_from(self, account: SenderAccount, message: EmailMessage):
+        """
+        Sends a message through one of the account's connections and records the outcome in its health.
+        A connection that failed is closed instead of being returned to the pool.
+        """
+        async with account.slots:
+            account.in_flight += 1
+            connection = None
+
+            try:
+                connection = await self._acquire(account)
+                await connection.send_message(message)
+
+            except SMTPRecipientsRefused:
+                account.idle.append((connection, time.monotonic()))
+                raise
+
+            except BaseException:
+                account.record(False)
+                if connection is not None:
+                    await self._close(connection)
+                raise
+
+            else:
+                account.record(True)
+                account.idle.append((connection, time.monotonic()))
+
+            finally:
+                account.in_flight -= 1
 
+        return
 
-            await aiosmtplib.send(
-                message,
-                username=email_sender["email"],
-                password=email_sender["password"],
-                hostname="smtp.gmail.com",
-                port=587,
-                start_tls=True,
-            )
+    async def probe(self, account: SenderAccount):
+        """
+        Checks the account by logging in and sending NOOP, without sending any email.
+        The connection is kept in the pool for the next emails.
+        """
+        async with account.slots:
+            connection = None
 
-        except SMTPAuthenticationError:
-            logging.warning(f"process='email test' !! Email \"{email_sender['email']}\" is not working.")
+            try:
+                connection = await self._acquire(account)
+                await connection.noop()
 
-            await send_to_admins(f"WARNING: Email \"{email_sender['email']}\" is not working")
+            except BaseException:
+                if connection is not None:
+                    await self._close(connection)
+                raise
 
-            failed_emails.append(email_sender)
+            account.idle.append((connection, time.monotonic()))
 
-    for email_sender in failed_emails:
-        emails.remove(email_sender);
+        return
 
-    logging.info("### Emails have been checked! ###")
+    async def _acquire(self, account: SenderAccount):
+        """
+        Returns an idle connection of the account that is still alive, or opens and logs in a new one.
+        """
+        while account.idle:
+            connection, last_used = account.idle.pop()
+
+            if not connection.is_connected:
+                continue
+
+            if time.monotonic() - last_used < self.keepalive:
+                return connection
+
+            try:
+                await connection.noop()
+                return connection
+            except (SMTPException, OSError, asyncio.TimeoutError):
+                await self._close(connection)
+
+        connection = aiosmtplib.SMTP(hostname=self.hostname, port=self.port, start_tls=self.start_tls, timeout=SMTP_TIMEOUT)
+
+        try:
+            await connection.connect()
+            await connection.login(account.email, account.password)
+        except BaseException:
+            await self._close(connection)
+            raise
+
+        return connection
+
+    async def _close(self, connection: aiosmtplib.SMTP):
+        """
+        Closes a connection, politely if it is still alive.
+        """
+        try:
+            if connection.is_connected:
+                await connection.quit()
+        except (SMTPException, OSError, asyncio.TimeoutError):
+            connection.close()
+
+        return
+
+
+email_sender = EmailSender(emails)
+
+
+async def send_email(email_to, text, user_id: int = None):
+    """
+    Queues an email with a verification code to the specified email address and returns right away.
+    If the email can't be sent and `user_id` is given, the user is told so.
+    """
+    await email_sender.put(email_to, text, user_id)
+
+    return
+
+
+async def test_email(account: SenderAccount):
+    """
+    Probes one account and marks it in the sender: accounts that can't log in are not used,
+    unreachable ones get the lowest health, so they are used only when no other account is left.
+    """
+    try:
+        await asyncio.wait_for(email_sender.probe(account), PROBE_TIMEOUT)
+        account.record(True)
+        return True
+
+    except SMTPAuthenticationError:
+        if account.working:
+            account.working = False
+            logging.warning(f"process='email test'                      !! Email \"{account.email}\" is not working.")
+
+            await send_to_admins(f"WARNING: Email \"{account.email}\" is not working")
+
+    except (SMTPException, OSError, asyncio.TimeoutError):
+        account.health = MIN_HEALTH
+        logging.warning(f"process='email test'                      !! Email \"{account.email}\" is unreachable.")
+
+    return False
+
+
+async def test_emails():
+    """
+    Tests all configured email accounts concurrently and marks the non-working ones, so they are not used.
+    """
+    logging.info("### Checking emails ... ###")
+
+    results = await asyncio.gather(*(test_email(account) for account in email_sender.accounts))
+
+    logging.info(f"### Emails have been checked: {sum(results)}/{len(results)} working! ###")
 
     return
+
+
+def start_email_test():
+    """
+    Starts testing the email accounts in the background, so the startup doesn't wait for SMTP.
+    """
+    task = asyncio.create_task(test_emails())
+
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+
+    return task
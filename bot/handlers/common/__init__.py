@@ -1 +1 @@
-from . import commands, common_handlers, addressing_errors, checks, pending
\ No newline at end of file
+from . import commands, common_handlers, addressing_errors, checks, session_middleware, concurrency_middleware
\ No newline at end of file
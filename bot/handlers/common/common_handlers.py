@@ -1,6 +1,12 @@
 from aiogram import Dispatcher
 
+from configs.env_reader import config
 from handlers.common import commands
+from handlers.common.session_middleware import UserSessionMiddleware
+from handlers.common.concurrency_middleware import ConcurrencyMiddleware
+
+
+update_concurrency = ConcurrencyMiddleware(config.UPDATE_CONCURRENCY)
 
 
 def register_handler_cancel(dp: Dispatcher):
@@ -19,3 +25,12 @@ def register_handler_zero_message(dp: Dispatcher):
     dp.include_routers(
         commands.zero_message.router,
     )
+
+
+def register_middlewares(dp: Dispatcher):
+    """
+    Registers the middleware that limits how many updates are handled at once
+    and the one that loads the sender's document once per message for all handlers.
+    """
+    dp.update.outer_middleware(update_concurrency)
+    dp.message.outer_middleware(UserSessionMiddleware())
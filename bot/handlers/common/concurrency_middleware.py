@@ -0,0 +1,26 @@
+import asyncio
+from aiogram import types, BaseMiddleware
+from typing import Any, Awaitable, Callable, Dict
+
+
+class ConcurrencyMiddleware(BaseMiddleware):
+    """
+    Limits how many updates are handled at once, the rest wait for a free slot.
+    Keeps a burst of updates from opening an unbounded number of MongoDB and Telegram requests.
+    """
+    def __init__(self, limit: int) -> None:
+        self.slots = asyncio.Semaphore(limit)
+        self.handling = 0
+
+    async def __call__(
+        self,
+        handler: Callable[[types.Update, Dict[str, Any]], Awaitable[Any]],
+        event: types.Update,
+        data: Dict[str, Any],
+    ) -> Any:
+        async with self.slots:
+            self.handling += 1
+            try:
+                return await handler(event, data)
+            finally:
+                self.handling -= 1
@@ -0,0 +1,43 @@
+from aiogram import types, BaseMiddleware
+from typing import Any, Awaitable, Callable, Dict
+
+from db.operations.user_profile import create_user
+from db.operations.users import find_user, update_user
+from db.operations.utils.conversion import user_conversion
+from db.operations.utils.session import UserSession, current_session
+
+
+class UserSessionMiddleware(BaseMiddleware):
+    """
+    Loads the sender's document once per message and shares it with the whole decorator chain and the handler.
+    Creates the user if they are not in MongoDB yet. `find_user` and `update_user` for this user are served
+    by the session, and all collected changes are committed with one update after the handler finishes.
+    """
+    async def __call__(
+        self,
+        handler: Callable[[types.Message, Dict[str, Any]], Awaitable[Any]],
+        event: types.Message,
+        data: Dict[str, Any],
+    ) -> Any:
+        if event.from_user is None:
+            return await handler(event, data)
+
+        user_id = event.from_user.id
+
+        user = await find_user(user_id)
+        if user is None:
+            user = await create_user(event)
+        elif user_conversion.peek(user_id) is None:
+            user_conversion.put(user_id, user["info"]["username"])
+
+        session = UserSession(user_id, user)
+
+        token = current_session.set(session)
+        try:
+            return await handler(event, data)
+        finally:
+            current_session.reset(token)
+            session.committed = True
+
+            if session.updates:
+                await update_user(user_id, session.updates)
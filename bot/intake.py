@@ -0,0 +1,258 @@
+import uuid
+import signal
+import asyncio
+import logging
+from collections import deque
+from datetime import datetime, timedelta
+from aiogram import Bot, Dispatcher
+from aiogram.types import Update
+from pymongo import ASCENDING
+from pymongo.errors import BulkWriteError
+
+from create_bot import dp, bot
+from db.connect import get_mongo_updates
+
+
+POLLING_TIMEOUT = 30
+MAX_BACKOFF = 30
+STOP_TIMEOUT = 10
+UPDATE_LEASE = 60                                       # seconds a claim holds without renewal before others may take it over
+LEASE_RENEWAL = 20                                      # seconds between renewals of the claims of updates in handling
+
+INSTANCE = uuid.uuid4().hex                             # marks the updates received by this process
+
+
+def update_user_id(update: dict):
+    """
+    Returns the id of the user (or the chat) an update comes from, or None if it has neither.
+    """
+    for event in update.values():
+        if not isinstance(event, dict):
+            continue
+
+        sender = event.get("from") or event.get("user") or event.get("chat")
+        if sender is not None:
+            return sender["id"]
+
+    return None
+
+
+class UpdateIntake:
+    """
+    Durable intake of Telegram updates.
+    Every update is written to the MongoDB 'updates' collection before it is dispatched and marked as handled
+    after its handler finishes, so updates received but not handled when a process stops are replayed later.
+    Updates of one user are handled one after another in the order they came, different users concurrently.
+    Handled updates are kept for a day (as long as Telegram may deliver them again), so repeated deliveries
+    are skipped.
+    A claim is a lease: it is renewed while its update is queued or handled, and other processes take over
+    only updates whose lease has expired.
+    """
+    def __init__(self, dp: Dispatcher, bot: Bot) -> None:
+        self.dp = dp
+        self.bot = bot
+
+        self.chains = {}                                # user -> updates in handling order, the first one is being handled
+        self.tasks = set()
+
+    async def receive(self, updates: list):
+        """
+        Writes raw updates to MongoDB, claims the ones that nobody is handling yet and dispatches them.
+        Stored updates are claimed separately, so an update stored by a write that failed halfway
+        is dispatched when Telegram delivers it again, while one already in handling is skipped.
+        """
+        mongo_updates = get_mongo_updates()
+
+        now = datetime.now()
+        entries = [{"_id": update["update_id"], "update": update, "owner": INSTANCE, "claim": None, "received": now}
+                   for update in updates]
+
+        try:
+            await mongo_updates.insert_many(entries, ordered=False)
+        except BulkWriteError as e:
+            if any(error["code"] != 11000 for error in e.details["writeErrors"]):       # 11000 - duplicate key
+                raise
+
+        claim = uuid.uuid4().hex
+        update_ids = [update["update_id"] for update in updates]
+        await mongo_updates.update_many(
+            {"_id": {"$in": update_ids}, "handled": {"$ne": True}, "claim": None},
+            {"$set": {"owner": INSTANCE, "claim": claim, "claimed_at": datetime.now()}}
+        )
+
+        claimed = {entry["_id"] async for entry in mongo_updates.find({"claim": claim}, {"_id": 1})}
+
+        for update in updates:
+            if update["update_id"] in claimed:
+                self.dispatch(update)
+
+        return
+
+    def dispatch(self, update: dict):
+        """
+        Queues an update behind the other updates of its user, starting a handling task if the user has none.
+        """
+        user_id = update_user_id(update)
+        key = user_id if user_id is not None else ("update", update["update_id"])
+
+        chain = self.chains.get(key)
+        if chain is not None:
+            chain.append(update)
+            return
+
+        self.chains[key] = deque([update])
+
+        task = asyncio.create_task(self._handle_chain(key))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+        return
+
+    async def _handle_chain(self, key):
+        """
+        Handles the queued updates of one user in order until none are left, renewing their leases meanwhile.
+        """
+        chain = self.chains[key]
+        renewal = asyncio.create_task(self._renew_leases(chain))
+
+        try:
+            while chain:
+                await self._handle(chain[0])
+                chain.popleft()
+        finally:
+            renewal.cancel()
+            del self.chains[key]
+
+    async def _renew_leases(self, chain: deque):
+        """
+        Renews the leases of the updates of a chain every LEASE_RENEWAL seconds until cancelled.
+        Updates taken over by another process are left to it.
+        """
+        while True:
+            await asyncio.sleep(LEASE_RENEWAL)
+
+            try:
+                await get_mongo_updates().update_many(
+                    {"_id": {"$in": [update["update_id"] for update in chain]}, "owner": INSTANCE},
+                    {"$set": {"claimed_at": datetime.now()}}
+                )
+            except Exception:
+                logging.exception(f"\nERROR: [Error renewing the leases of updates in handling]\nTRACEBACK:")
+
+    async def _handle(self, update: dict):
+        """
+        Feeds an update to the dispatcher and marks it as handled. An update that failed is marked too,
+        so it isn't replayed over and over. An update whose handling was cancelled stays unhandled.
+        """
+        try:
+            await self.dp.feed_update(self.bot, Update.model_validate(update, context={"bot": self.bot}))
+        except Exception:
+            logging.exception(f"\nERROR: [Error handling update {update['update_id']}]\nTRACEBACK:")
+
+        try:
+            await get_mongo_updates().update_one({"_id": update["update_id"]}, {"$set": {"handled": True}})
+        except Exception:
+            logging.exception(f"\nERROR: [Error marking update {update['update_id']} as handled]\nTRACEBACK:")
+
+        return
+
+    async def replay(self, received_before: datetime, lease: float = UPDATE_LEASE):
+        """
+        Dispatches the updates received before the given time and left unhandled, oldest first: the ones nobody
+        has claimed and the ones whose lease hasn't been renewed for `lease` seconds. A process that is the only one
+        receiving updates passes 0, since all claims left are of stopped processes.
+        Returns the number of replayed updates.
+        """
+        mongo_updates = get_mongo_updates()
+
+        now = datetime.now()
+        claim = uuid.uuid4().hex
+        await mongo_updates.update_many(
+            {"received": {"$lt": received_before}, "handled": {"$ne": True},
+             "$or": [{"claim": None}, {"claimed_at": {"$lte": now - timedelta(seconds=lease)}}]},
+            {"$set": {"owner": INSTANCE, "claim": claim, "claimed_at": now}}
+        )
+
+        replayed = 0
+        async for entry in mongo_updates.find({"claim": claim}).sort("_id", ASCENDING):
+            self.dispatch(entry["update"])
+            replayed += 1
+
+        logging.info(f"process='update intake'                   !! {replayed} unhandled updates are replayed.")
+
+        return replayed
+
+    async def poll(self):
+        """
+        Receives updates by long polling until cancelled. Updates are written to MongoDB before they are confirmed
+        to Telegram, so if writing fails, Telegram delivers them again.
+        """
+        allowed_updates = self.dp.resolve_used_update_types()
+
+        offset = None
+        backoff = 1
+
+        while True:
+            try:
+                updates = await self.bot.get_updates(offset=offset, timeout=POLLING_TIMEOUT, allowed_updates=allowed_updates)
+                if updates:
+                    await self.receive([update.model_dump(mode="json", by_alias=True, exclude_none=True) for update in updates])
+                    offset = updates[-1].update_id + 1
+
+                backoff = 1
+
+            except Exception:
+                logging.exception(f"\nERROR: [Error receiving updates, retrying in {backoff} s]\nTRACEBACK:")
+
+                await asyncio.sleep(backoff)
+                backoff = min(2 * backoff, MAX_BACKOFF)
+
+    async def stop(self, timeout: float = STOP_TIMEOUT):
+        """
+        Waits for the updates in handling and cancels the ones still handled after the timeout.
+        Cancelled and queued updates stay unhandled and are replayed on the next start.
+        """
+        if not self.tasks:
+            return
+
+        _, pending = await asyncio.wait(self.tasks, timeout=timeout)
+
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+
+        return
+
+
+update_intake = UpdateIntake(dp, bot)
+
+
+async def run_polling(dp: Dispatcher, bot: Bot):
+    """
+    Runs the dispatcher's startup, replays the updates left unhandled by the previous run and polls for new ones
+    until SIGINT or SIGTERM, then runs the dispatcher's shutdown.
+    """
+    await bot.delete_webhook()                          # Telegram doesn't give updates to polling while a webhook is set
+
+    await dp.emit_startup(bot=bot, dispatcher=dp)
+
+    try:
+        # before polling, so replayed updates go first in their chains; the leases of the stopped process are void
+        await update_intake.replay(datetime.now(), lease=0)
+
+        polling = asyncio.create_task(update_intake.poll())
+
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, polling.cancel)
+
+        try:
+            await polling
+        except asyncio.CancelledError:
+            pass
+
+    finally:
+        await dp.emit_shutdown(bot=bot, dispatcher=dp)
+        await bot.session.close()
+
+    return
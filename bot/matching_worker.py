@@ -0,0 +1,31 @@
+import importlib.util
+from pathlib import Path
+
+
+ENGINE_PATH = Path(__file__).parent / "handlers" / "admin" / "matching" / "engine.py"
+
+engine = None
+
+
+def load_engine():
+    """
+    Initializer of the matching worker processes. Loads the engine by its file: importing it from its package
+    would import the whole bot into every worker.
+    """
+    global engine
+
+    if engine is None:
+        spec = importlib.util.spec_from_file_location("matching_engine", ENGINE_PATH)
+        engine = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(engine)
+
+    return
+
+
+def solve_matching(problem: dict, mode: str, seed: int):
+    """
+    Entry point of the matching worker processes, see `engine.solve_matching`.
+    """
+    load_engine()
+
+    return engine.solve_matching(problem, mode, seed)
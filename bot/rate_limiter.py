@@ -0,0 +1,50 @@
+import asyncio
+
+
+class RateLimiter:
+    """
+    Spaces out Telegram API calls to stay within the global limit (messages per second across all chats)
+    and the per-chat limit (one message per `chat_interval` seconds to the same chat).
+    `pause` delays all calls, e.g. after Telegram answers with RetryAfter.
+    """
+    def __init__(self, rate: float = 25, chat_interval: float = 1.0, max_chats: int = 10000) -> None:
+        self.interval = 1 / rate
+        self.chat_interval = chat_interval
+        self.max_chats = max_chats
+
+        self.next_slot = 0.0
+        self.next_chat_slot = {}
+
+    async def wait(self, chat_id: int = None):
+        """
+        Waits until a call to the given chat is allowed. Slots are reserved without awaiting, so no lock is needed.
+        """
+        now = asyncio.get_running_loop().time()
+
+        slot = max(now, self.next_slot)
+        if chat_id is not None:
+            slot = max(slot, self.next_chat_slot.get(chat_id, 0.0))
+            self.next_chat_slot[chat_id] = slot + self.chat_interval
+
+            if len(self.next_chat_slot) > self.max_chats:
+                self.next_chat_slot = {chat: t for chat, t in self.next_chat_slot.items() if t > now}
+
+        self.next_slot = slot + self.interval
+
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+        return
+
+    def pause(self, seconds: float):
+        """
+        Delays all further calls by the given number of seconds.
+        """
+        now = asyncio.get_running_loop().time()
+
+        self.next_slot = max(self.next_slot, now + seconds)
+
+        return
+
+
+telegram_limiter = RateLimiter()
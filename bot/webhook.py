@@ -0,0 +1,130 @@
+import hmac
+import signal
+import asyncio
+import hashlib
+import logging
+from aiohttp import web
+from datetime import datetime, timedelta
+from aiogram import Bot, Dispatcher
+from aiogram.webhook.aiohttp_server import setup_application
+
+from intake import update_intake, UPDATE_LEASE
+from configs.env_reader import config
+from handlers.common.common_handlers import update_concurrency
+
+
+REPLAY_INTERVAL = 60                                    # seconds between looks for updates abandoned by stopped processes
+
+background_tasks = set()
+
+
+def webhook_secret():
+    """
+    Returns the secret Telegram sends with every update. If it is not configured, it is derived from the bot token,
+    so all processes behind one endpoint agree on it.
+    """
+    if config.WEBHOOK_SECRET is not None:
+        return config.WEBHOOK_SECRET.get_secret_value()
+
+    return hashlib.sha256(config.TG_BOT_TOKEN.get_secret_value().encode()).hexdigest()
+
+
+async def receive_update(request: web.Request):
+    """
+    Accepts an update posted by Telegram. It is written to MongoDB before Telegram gets the answer
+    and handled in the background. Requests without the secret token are rejected.
+    """
+    token = request.headers.get("X-Telegram-Bot-Api-Secret-Token", "")
+    if not hmac.compare_digest(token, request.app["secret_token"]):
+        return web.Response(text="Unauthorized", status=401)
+
+    await update_intake.receive([await request.json()])
+
+    return web.json_response({})
+
+
+async def health(request: web.Request):
+    """
+    Answers health checks of the load balancer with the number of updates being handled.
+    """
+    return web.json_response({"status": "ok", "handling": update_concurrency.handling})
+
+
+async def close_bot_session(app: web.Application):
+    """
+    Closes the bot's HTTP session when the app is cleaned up.
+    """
+    await app["bot"].session.close()
+
+
+def create_app(dp: Dispatcher, bot: Bot, secret_token: str):
+    """
+    Creates the aiohttp app that feeds updates posted by Telegram to the update intake and serves the health route.
+    """
+    app = web.Application()
+    app["bot"] = bot
+    app["secret_token"] = secret_token
+
+    app.router.add_post(config.WEBHOOK_PATH, receive_update)
+    app.router.add_get("/health", health)
+
+    setup_application(app, dp, bot=bot)
+    app.on_cleanup.append(close_bot_session)            # after the shutdown, which still sends messages
+
+    return app
+
+
+async def replay_abandoned():
+    """
+    Replays the updates left unhandled by stopped processes every REPLAY_INTERVAL seconds until cancelled.
+    Other processes behind the endpoint renew the leases of the updates they are handling, so only updates
+    whose lease has expired are taken.
+    """
+    while True:
+        await asyncio.sleep(REPLAY_INTERVAL)
+
+        try:
+            await update_intake.replay(datetime.now() - timedelta(seconds=UPDATE_LEASE))
+        except Exception:
+            logging.exception(f"\nERROR: [Error replaying abandoned updates]\nTRACEBACK:")
+
+
+async def run_webhook(dp: Dispatcher, bot: Bot):
+    """
+    Serves the webhook until SIGINT or SIGTERM, then runs the dispatcher's shutdown with the app's cleanup.
+    The webhook is set after the server has started listening, so Telegram doesn't deliver updates
+    before anyone can accept them.
+    """
+    secret_token = webhook_secret()
+
+    runner = web.AppRunner(create_app(dp, bot, secret_token))
+    await runner.setup()
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    try:
+        site = web.TCPSite(runner, config.WEBHOOK_HOST, config.WEBHOOK_PORT)
+        await site.start()
+
+        await bot.set_webhook(
+            config.WEBHOOK_URL.rstrip("/") + config.WEBHOOK_PATH,
+            secret_token=secret_token,
+            max_connections=min(config.UPDATE_CONCURRENCY, 100),
+            allowed_updates=dp.resolve_used_update_types()
+        )
+        logging.info(f"process='webhook'                         !! Serving updates on port {config.WEBHOOK_PORT}.")
+
+        task = asyncio.create_task(replay_abandoned())
+        background_tasks.add(task)
+        task.add_done_callback(background_tasks.discard)
+
+        await stop.wait()
+        task.cancel()
+
+    finally:
+        await runner.cleanup()                          # runs the dispatcher's shutdown
+
+    return
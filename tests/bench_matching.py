@@ -0,0 +1,39 @@
+"""
+Times the matching engine on random cohorts up to 100k users and checks every solution with the tests' checks.
+
+    python tests/bench_matching.py [sizes...]
+"""
+import sys
+import time
+
+from conftest import load_module
+from test_matching_engine import random_problem, check_assignments
+
+
+SIZES = [1_000, 10_000, 100_000]
+MODES = ["greedy", "optimal"]
+
+
+def main(sizes):
+    engine = load_module("engine", "handlers/admin/matching/engine.py")
+
+    print(f"{'users':>8} {'mode':>8} {'solver':>16} {'time, s':>8} {'short':>6} {'mean score':>10}")
+
+    for n in sizes:
+        problem = random_problem(n)
+
+        for mode in MODES:
+            time_started = time.perf_counter()
+            assignments, stats = engine.solve_matching(problem, mode, seed=0)
+            elapsed = time.perf_counter() - time_started
+
+            short = check_assignments(engine, problem, assignments)
+            mean_score = stats["score"] / max(stats["assignments"], 1)
+
+            print(f"{n:>8} {mode:>8} {stats['solver']:>16} {elapsed:>8.2f} {short:>6} {mean_score:>10.1f}")
+
+    return
+
+
+if __name__ == "__main__":
+    main([int(size) for size in sys.argv[1:]] or SIZES)
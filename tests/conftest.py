@@ -0,0 +1,49 @@
+import os
+import sys
+import socket
+import importlib.util
+from pathlib import Path
+
+import pytest
+
+
+BOT_DIR = Path(__file__).resolve().parent.parent / "bot"
+sys.path.insert(0, str(BOT_DIR))
+
+# the settings are read on import; tests never reach Telegram, MongoDB or the mail servers
+for name, value in {
+    "TG_BOT_TOKEN": "123456:TEST",
+    "MONGODB_USERNAME": "test",
+    "MONGODB_PASSWORD": "test",
+    "EMAIL1_PASSWORD": "test",
+    "EMAIL2_PASSWORD": "test",
+    "EMAIL4_PASSWORD": "test",
+    "EMAIL5_PASSWORD": "test",
+    "EMAIL6_PASSWORD": "test",
+}.items():
+    os.environ.setdefault(name, value)
+
+
+def load_module(name: str, path: str):
+    """
+    Loads a module of the bot from its file, without importing the package around it (and with it the whole bot).
+    """
+    spec = importlib.util.spec_from_file_location(name, BOT_DIR / path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+
+    return module
+
+
+def free_port():
+    """
+    Returns a local port that nothing listens on.
+    """
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+@pytest.fixture(scope="session")
+def engine():
+    return load_module("engine", "handlers/admin/matching/engine.py")
@@ -0,0 +1,127 @@
+import asyncio
+
+import pytest
+
+pytest.importorskip("aiosmtpd")
+
+from aiosmtpd.smtp import AuthResult
+from aiosmtpd.controller import Controller
+
+import app                                              # imports the handlers in the order the bot does
+from handlers.client import email
+from conftest import free_port
+
+
+BROKEN_ACCOUNT = "broken@nes.ru"
+
+
+class Mailbox:
+    """
+    SMTP server stand-in that keeps the recipients of received emails and the sessions they came through.
+    Logins of BROKEN_ACCOUNT are refused.
+    """
+    def __init__(self) -> None:
+        self.recipients = []
+        self.sessions = set()
+
+    async def handle_DATA(self, server, session, envelope):
+        self.recipients += envelope.rcpt_tos
+        self.sessions.add(id(session))
+
+        return "250 OK"
+
+    def authenticate(self, server, session, envelope, mechanism, auth_data):
+        return AuthResult(success=auth_data.login.decode() != BROKEN_ACCOUNT, handled=False)
+
+
+@pytest.fixture
+def mailbox():
+    mailbox = Mailbox()
+    controller = Controller(mailbox, hostname="127.0.0.1", port=free_port(),
+                            authenticator=mailbox.authenticate, auth_require_tls=False)
+    controller.start()
+    mailbox.port = controller.port
+
+    yield mailbox
+
+    controller.stop()
+
+
+@pytest.fixture
+def admin_messages(monkeypatch):
+    messages = []
+
+    async def send_to_admins(text):
+        messages.append(text)
+
+    monkeypatch.setattr(email, "send_to_admins", send_to_admins)
+
+    return messages
+
+
+def sender(mailbox, *accounts, **kwargs):
+    return email.EmailSender([{"email": account, "password": "password"} for account in accounts],
+                             hostname="127.0.0.1", port=mailbox.port, start_tls=False, **kwargs)
+
+
+def send_all(email_sender, recipients):
+    async def run():
+        await email_sender.start()
+        for recipient in recipients:
+            await email_sender.put(recipient, "Код: 123456")
+        await email_sender.stop()
+
+    asyncio.run(run())
+
+
+def test_queued_emails_are_sent_through_pooled_connections(mailbox, admin_messages):
+    recipients = [f"user{i}@nes.ru" for i in range(50)]
+
+    send_all(sender(mailbox, "first@nes.ru", "second@nes.ru"), recipients)
+
+    assert sorted(mailbox.recipients) == sorted(recipients)
+    assert len(mailbox.sessions) <= 2 * email.CONNECTIONS_PER_ACCOUNT
+    assert admin_messages == []
+
+
+def test_account_that_cant_log_in_is_dropped(mailbox, admin_messages):
+    email_sender = sender(mailbox, BROKEN_ACCOUNT, "working@nes.ru")
+    recipients = [f"user{i}@nes.ru" for i in range(10)]
+
+    send_all(email_sender, recipients)
+
+    assert sorted(mailbox.recipients) == sorted(recipients)
+    assert [account.working for account in email_sender.accounts] == [False, True]
+    assert admin_messages == [f"WARNING: Email \"{BROKEN_ACCOUNT}\" is not working"]
+
+
+def test_worker_survives_an_unexpected_error(mailbox, admin_messages, monkeypatch):
+    email_sender = sender(mailbox, "working@nes.ru", workers=1)
+    send_from = email_sender.send_from
+
+    async def failing_send_from(account, message):
+        if message["To"] == "unlucky@nes.ru":
+            raise RuntimeError("unexpected")
+        await send_from(account, message)
+
+    monkeypatch.setattr(email_sender, "send_from", failing_send_from)
+
+    send_all(email_sender, ["unlucky@nes.ru", "user@nes.ru"])
+
+    assert mailbox.recipients == ["user@nes.ru"]
+
+
+def test_dropped_connection_is_reopened(mailbox, admin_messages):
+    email_sender = sender(mailbox, "working@nes.ru", keepalive=0)
+
+    async def run():
+        await email_sender.send("first@nes.ru", "Код: 123456")
+
+        connection, _ = email_sender.accounts[0].idle[0]
+        connection.close()
+
+        return await email_sender.send("second@nes.ru", "Код: 123456")
+
+    assert asyncio.run(run())
+    assert mailbox.recipients == ["first@nes.ru", "second@nes.ru"]
+    assert len(mailbox.sessions) == 2
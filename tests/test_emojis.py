@@ -0,0 +1,44 @@
+import pytest
+
+from conftest import load_module
+
+
+@pytest.fixture(scope="module")
+def emojis():
+    return load_module("emojis", "handlers/admin/matching/emojis.py")
+
+
+def test_pool_is_valid_and_cached(emojis):
+    pool = emojis.emoji_pool()
+
+    emojis.validate_emoji_pool(pool)
+    assert emojis.emoji_pool() is pool
+    assert "1⃣" not in pool                        # keycaps are two code points
+
+
+@pytest.mark.parametrize("pool, error", [
+    ((), "empty"),
+    (("😀", "😀"), "duplicates"),
+    (("😀", "1⃣"), "several code points"),
+])
+def test_invalid_pool_is_rejected(emojis, pool, error):
+    with pytest.raises(ValueError, match=error):
+        emojis.validate_emoji_pool(pool)
+
+
+@pytest.mark.parametrize("n", [0, 1, 100, "pool", "pairs"])
+def test_drawn_emojis_are_distinct(emojis, n):
+    size = len(emojis.emoji_pool())
+    n = {"pool": size, "pairs": 3 * size}.get(n, n)
+
+    drawn = emojis.draw_emojis(n)
+
+    assert len(drawn) == n
+    assert len(set(drawn)) == n
+
+
+def test_too_many_users_for_pairs(emojis):
+    size = len(emojis.emoji_pool())
+
+    with pytest.raises(ValueError):
+        emojis.draw_emojis(size * size + 1)
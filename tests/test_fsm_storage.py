@@ -0,0 +1,96 @@
+import asyncio
+import importlib.util
+
+import pytest
+
+fakeredis = pytest.importorskip("fakeredis")
+
+from pydantic import SecretStr
+from aiogram.fsm.context import FSMContext
+from aiogram.fsm.storage.base import StorageKey
+from aiogram.fsm.storage.redis import RedisStorage, RedisEventIsolation
+
+import app                                              # imports the handlers in the order the bot does
+import create_bot
+from configs.env_reader import config
+from handlers.client.commands.start import StartStates
+
+
+KEY = StorageKey(bot_id=123456, chat_id=42, user_id=42)
+
+# RedisEventIsolation releases its lock with a Lua script, which fakeredis runs only with lupa (fakeredis[lua])
+needs_lua = pytest.mark.skipif(importlib.util.find_spec("lupa") is None, reason="fakeredis can't run Lua without lupa")
+
+
+@pytest.fixture
+def redis_server(monkeypatch):
+    """
+    Points the dispatcher's storage at an in-process Redis stand-in shared by all dispatchers of the test.
+    """
+    server = fakeredis.FakeServer()
+
+    class FakeRedisStorage(RedisStorage):
+        @classmethod
+        def from_url(cls, url, connection_kwargs=None, **kwargs):
+            return cls(redis=fakeredis.FakeAsyncRedis(server=server), **kwargs)
+
+    monkeypatch.setattr(create_bot, "RedisStorage", FakeRedisStorage)
+    monkeypatch.setattr(config, "REDIS_URL", SecretStr("redis://localhost:6379/0"))
+
+    return server
+
+
+def test_memory_storage_without_redis(monkeypatch):
+    monkeypatch.setattr(config, "REDIS_URL", None)
+
+    assert not isinstance(create_bot.create_dispatcher().storage, RedisStorage)
+
+
+def test_state_survives_a_restart(redis_server):
+    async def run():
+        dp = create_bot.create_dispatcher()
+        await FSMContext(dp.storage, KEY).set_state(StartStates.EMAIL_SET)
+        await FSMContext(dp.storage, KEY).update_data(attempts=3)
+
+        restarted = create_bot.create_dispatcher()
+        state = await FSMContext(restarted.storage, KEY).get_state()
+        data = await FSMContext(restarted.storage, KEY).get_data()
+
+        redis = fakeredis.FakeAsyncRedis(server=redis_server)
+        ttls = {key.decode(): await redis.ttl(key) for key in await redis.keys()}
+
+        return state, data, ttls
+
+    state, data, ttls = asyncio.run(run())
+
+    assert state == StartStates.EMAIL_SET.state
+    assert data == {"attempts": 3}
+    assert set(ttls) == {f"{config.FSM_KEY_PREFIX}:123456:42:42:state", f"{config.FSM_KEY_PREFIX}:123456:42:42:data"}
+    assert all(0 < ttl <= config.FSM_STATE_TTL for ttl in ttls.values())
+
+
+@needs_lua
+def test_updates_of_a_user_are_locked_across_processes(redis_server):
+    async def run():
+        first = create_bot.create_dispatcher().fsm.events_isolation
+        second = create_bot.create_dispatcher().fsm.events_isolation
+
+        locked = asyncio.Event()
+
+        async def handle_in_second():
+            async with second.lock(KEY):
+                locked.set()
+
+        async with first.lock(KEY):
+            task = asyncio.create_task(handle_in_second())
+            await asyncio.sleep(0.3)
+            locked_meanwhile = locked.is_set()
+
+        await asyncio.wait_for(task, 5)
+
+        return first, locked_meanwhile
+
+    isolation, locked_meanwhile = asyncio.run(run())
+
+    assert isinstance(isolation, RedisEventIsolation)
+    assert not locked_meanwhile
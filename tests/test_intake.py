@@ -0,0 +1,155 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+
+mongomock_motor = pytest.importorskip("mongomock_motor")
+
+import app                                              # imports the handlers in the order the bot does
+import intake
+from db import connect
+from aiogram import Dispatcher, Router
+
+
+def message_update(update_id, user_id, text=None):
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": 1700000000,
+            "chat": {"id": user_id, "type": "private"},
+            "from": {"id": user_id, "is_bot": False, "first_name": "test"},
+            "text": text or str(update_id),
+        },
+    }
+
+
+@pytest.fixture
+def updates():
+    connect.mongo_updates = mongomock_motor.AsyncMongoMockClient()["db"]["updates"]
+    yield connect.mongo_updates
+    connect.mongo_updates = None
+
+
+@pytest.fixture
+def handled():
+    return []
+
+
+@pytest.fixture
+def update_intake(handled):
+    dp = Dispatcher()
+    router = Router()
+
+    @router.message()
+    async def handler(message):
+        await asyncio.sleep(0.001 * (message.message_id % 3))
+        if message.text == "fail":
+            raise RuntimeError("handler failed")
+        handled.append((message.from_user.id, message.message_id))
+
+    dp.include_router(router)
+
+    return intake.UpdateIntake(dp, app.bot)
+
+
+async def wait_handled(update_intake):
+    while update_intake.tasks:
+        await asyncio.sleep(0.001)
+
+
+def test_replay_keeps_per_user_order(updates, update_intake, handled):
+    async def run():
+        received = datetime.now()
+        await updates.insert_many([{"_id": i, "update": message_update(i, i % 10), "owner": "stopped", "claim": "old",
+                                    "claimed_at": received, "received": received} for i in range(100)])
+
+        assert await update_intake.replay(datetime.now(), lease=0) == 100
+        await update_intake.receive([message_update(100 + i, i % 10) for i in range(20)])
+        await wait_handled(update_intake)
+
+    asyncio.run(run())
+
+    assert len(handled) == 120 and len(set(handled)) == 120
+    for user_id in range(10):
+        ids = [update_id for user, update_id in handled if user == user_id]
+        assert ids == sorted(ids)
+
+
+def test_repeated_delivery_is_skipped_and_failed_handler_is_marked(updates, update_intake, handled):
+    async def run():
+        await update_intake.receive([message_update(1, 1), message_update(2, 2, "fail")])
+        await wait_handled(update_intake)
+        await update_intake.receive([message_update(1, 1)])
+        await wait_handled(update_intake)
+
+        return await updates.count_documents({"handled": {"$ne": True}})
+
+    assert asyncio.run(run()) == 0
+    assert handled == [(1, 1)]
+
+
+def test_updates_stored_by_a_failed_write_are_dispatched_on_redelivery(updates, update_intake, handled):
+    async def run():
+        # the write of the batch failed after the first update was stored, so nobody claimed it
+        await updates.insert_one({"_id": 1, "update": message_update(1, 1), "owner": intake.INSTANCE, "claim": None,
+                                  "received": datetime.now()})
+
+        await update_intake.receive([message_update(1, 1), message_update(2, 1)])
+        await wait_handled(update_intake)
+
+    asyncio.run(run())
+
+    assert handled == [(1, 1), (1, 2)]
+
+
+def test_replay_takes_over_only_expired_leases(updates, update_intake, handled):
+    async def run():
+        now = datetime.now() - timedelta(seconds=1)
+        await updates.insert_many([
+            {"_id": 1, "update": message_update(1, 1), "owner": "alive", "claim": "a", "claimed_at": now, "received": now},
+            {"_id": 2, "update": message_update(2, 2), "owner": "stopped", "claim": "b",
+             "claimed_at": now - timedelta(seconds=2 * intake.UPDATE_LEASE), "received": now},
+        ])
+
+        replayed = await update_intake.replay(datetime.now())
+        await wait_handled(update_intake)
+
+        return replayed, await updates.find_one({"_id": 1})
+
+    replayed, alive = asyncio.run(run())
+
+    assert replayed == 1
+    assert handled == [(2, 2)]
+    assert alive["owner"] == "alive" and "handled" not in alive
+
+
+def test_leases_are_renewed_while_updates_are_handled(updates, handled, monkeypatch):
+    monkeypatch.setattr(intake, "LEASE_RENEWAL", 0.01)
+
+    dp = Dispatcher()
+    router = Router()
+
+    @router.message()
+    async def handler(message):
+        await asyncio.sleep(0.1)
+        handled.append((message.from_user.id, message.message_id))
+
+    dp.include_router(router)
+    update_intake = intake.UpdateIntake(dp, app.bot)
+
+    async def run():
+        await update_intake.receive([message_update(1, 1), message_update(2, 1)])
+        claimed_at = (await updates.find_one({"_id": 2}))["claimed_at"]
+
+        await asyncio.sleep(0.05)                       # the second update is still queued behind the first one
+        renewed_at = (await updates.find_one({"_id": 2}))["claimed_at"]
+
+        await wait_handled(update_intake)
+
+        return claimed_at, renewed_at
+
+    claimed_at, renewed_at = asyncio.run(run())
+
+    assert renewed_at > claimed_at
+    assert handled == [(1, 1), (1, 2)]
@@ -0,0 +1,78 @@
+import asyncio
+
+import pytest
+
+mongomock_motor = pytest.importorskip("mongomock_motor")
+
+from pymongo.errors import AutoReconnect
+
+import app                                              # imports the handlers in the order the bot does
+from db import connect
+from db.operations.journal import MessageJournal
+
+
+@pytest.fixture
+def messages():
+    connect.mongo_messages = mongomock_motor.AsyncMongoMockClient()["db"]["messages"]
+    yield connect.mongo_messages
+    connect.mongo_messages = None
+
+
+def failing_writes(monkeypatch, messages, failures: int, written_before_failing: bool = False):
+    """
+    Makes the next `failures` writes to the collection fail, optionally after the documents were stored.
+    """
+    insert_many = messages.insert_many
+    left = [failures]
+
+    async def flaky_insert_many(documents, *args, **kwargs):
+        if left[0] > 0:
+            left[0] -= 1
+            if written_before_failing:
+                await insert_many(documents, *args, **kwargs)
+            raise AutoReconnect("connection lost")
+
+        return await insert_many(documents, *args, **kwargs)
+
+    monkeypatch.setattr(messages, "insert_many", flaky_insert_many)
+
+
+def journal_run(journal, count):
+    async def run():
+        await journal.start()
+        for i in range(count):
+            await journal.put({"user_id": 1, "side": "bot", "datetime": "2024-01-01 10:00:00", "message": str(i)})
+        await journal.stop()
+
+    asyncio.run(run())
+
+
+@pytest.mark.parametrize("written_before_failing", [False, True])
+def test_failed_writes_are_retried_without_duplicates(messages, monkeypatch, written_before_failing):
+    failing_writes(monkeypatch, messages, 2, written_before_failing)
+    journal = MessageJournal(backoff=0.01)
+
+    journal_run(journal, 100)
+
+    assert asyncio.run(messages.count_documents({})) == 100
+    assert journal.lost == 0
+
+
+def test_batches_that_keep_failing_are_requeued(messages, monkeypatch):
+    failing_writes(monkeypatch, messages, 4)            # more than the attempts of one write
+    journal = MessageJournal(backoff=0.01, attempts=3)
+
+    journal_run(journal, 100)
+
+    assert asyncio.run(messages.count_documents({})) == 100
+    assert journal.lost == 0
+
+
+def test_entries_that_dont_fit_back_are_counted_as_lost(messages, monkeypatch):
+    failing_writes(monkeypatch, messages, 1000)
+    journal = MessageJournal(max_size=10, batch_size=5, backoff=0, attempts=1)
+
+    journal_run(journal, 30)
+
+    assert asyncio.run(messages.count_documents({})) == 0
+    assert journal.lost == 30
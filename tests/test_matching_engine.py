@@ -0,0 +1,140 @@
+import numpy as np
+import pytest
+
+
+def random_problem(n, seed=0, questions=10, girls_share=0.5, gay_share=0.0, blacklist=2):
+    """
+    Returns a random matching problem of n users, `girls_share` of them girls and `gay_share` of them looking
+    for their own sex, with `blacklist` random blacklist entries per user.
+    """
+    rng = np.random.default_rng(seed)
+    sex = (rng.random(n) < girls_share).astype(np.int8)
+    partner_sex = np.where(rng.random(n) < gay_share, sex, 1 - sex).astype(np.int8)
+
+    return {
+        "n": n,
+        "forbidden_sources": rng.integers(0, n, blacklist * n) if n else np.zeros(0, dtype=np.int64),
+        "forbidden_targets": rng.integers(0, n, blacklist * n) if n else np.zeros(0, dtype=np.int64),
+        "sex": sex,
+        "partner_sex": partner_sex,
+        "answers": rng.integers(-2, 3, (n, questions)).astype(np.int8),
+        "partner_answers": rng.integers(-2, 3, (n, questions)).astype(np.int8),
+    }
+
+
+def check_assignments(engine, problem, assignments):
+    """
+    Asserts that the assignments are a valid solution of the problem: nobody is assigned to themselves,
+    blacklists hold in both directions, sexes fit each other, nobody is assigned twice to one user
+    or to more than DEGREE users, and every row has its assignments before the -1 padding.
+    Returns the number of users left short of DEGREE assignments.
+    """
+    n = problem["n"]
+    assert assignments.shape == (n, engine.DEGREE)
+
+    assigned = assignments >= 0
+    assert (assigned[:, :-1] >= assigned[:, 1:]).all()
+
+    sources, slots = np.nonzero(assigned)
+    targets = assignments[sources, slots]
+
+    forbidden = set(zip(problem["forbidden_sources"].tolist(), problem["forbidden_targets"].tolist()))
+    for source, target in zip(sources.tolist(), targets.tolist()):
+        assert source != target
+        assert (source, target) not in forbidden and (target, source) not in forbidden
+
+    sex, partner_sex = problem["sex"], problem["partner_sex"]
+    assert (partner_sex[sources] == sex[targets]).all() and (partner_sex[targets] == sex[sources]).all()
+
+    assert np.bincount(targets, minlength=n).max(initial=0) <= engine.DEGREE
+    assert np.unique(sources * n + targets).size == sources.size
+
+    return int((~assigned).any(axis=1).sum())
+
+
+@pytest.mark.parametrize("mode", ["greedy", "optimal"])
+def test_empty_cohort(engine, mode):
+    assignments, stats = engine.solve_matching(random_problem(0), mode, seed=0)
+
+    assert assignments.shape == (0, engine.DEGREE)
+    assert stats["assignments"] == 0 and stats["score"] == 0
+
+
+@pytest.mark.parametrize("mode", ["greedy", "optimal"])
+@pytest.mark.parametrize("seed", range(5))
+@pytest.mark.parametrize("n, gay_share, blacklist", [(2, 0.0, 0), (7, 0.0, 1), (60, 0.0, 2), (60, 0.2, 5), (500, 0.05, 3)])
+def test_solution_is_valid(engine, mode, seed, n, gay_share, blacklist):
+    problem = random_problem(n, seed, gay_share=gay_share, blacklist=blacklist)
+
+    assignments, stats = engine.solve_matching(problem, mode, seed)
+
+    check_assignments(engine, problem, assignments)
+    assert stats["solver"] == mode
+    assert stats["assignments"] == (assignments >= 0).sum()
+
+
+@pytest.mark.parametrize("mode", ["greedy", "optimal"])
+@pytest.mark.parametrize("seed", range(3))
+def test_unequal_sexes_fill_the_minority(engine, mode, seed):
+    problem = random_problem(300, seed, girls_share=0.3)
+
+    assignments, _ = engine.solve_matching(problem, mode, seed)
+
+    check_assignments(engine, problem, assignments)
+
+    # boys have room for all girls' assignments, while girls can take only as many as they give,
+    # so at most as many boys as there are girls get both of theirs
+    short = (assignments < 0).any(axis=1)
+    assert not short[problem["sex"] == 1].any()
+    assert short.sum() >= (problem["sex"] == 0).sum() - (problem["sex"] == 1).sum()
+
+
+@pytest.mark.parametrize("seed", range(3))
+def test_fallback_to_greedy(engine, monkeypatch, seed):
+    monkeypatch.setattr(engine, "auction_matching", lambda *args, **kwargs: None)      # the auction ran out of time
+    problem = random_problem(200, seed)
+
+    assignments, stats = engine.solve_matching(problem, "optimal", seed)
+
+    check_assignments(engine, problem, assignments)
+    assert stats["solver"] == engine.GREEDY_FALLBACK
+
+
+def test_auction_gives_up_after_its_budget(engine):
+    problem = random_problem(200)
+    eligibility = engine.Eligibility(problem["n"], problem["forbidden_sources"], problem["forbidden_targets"],
+                                     problem["sex"], problem["partner_sex"])
+    compatibility = engine.Compatibility(problem["answers"], problem["partner_answers"])
+    rng = np.random.default_rng(0)
+    candidates, candidate_scores = engine.top_candidates(eligibility, compatibility, rng)
+
+    assert engine.auction_matching(eligibility, candidates, candidate_scores, rng, budget=-1) is None
+
+
+@pytest.mark.parametrize("seed", range(5))
+@pytest.mark.parametrize("n", [5, 40, 300])
+def test_users_without_candidates_are_filled(engine, seed, n):
+    problem = random_problem(n, seed, blacklist=0)
+    problem["sex"] = problem["partner_sex"] = np.zeros(n, dtype=np.int8)
+    eligibility = engine.Eligibility(n, problem["forbidden_sources"], problem["forbidden_targets"],
+                                     problem["sex"], problem["partner_sex"])
+
+    candidates = np.full((n, 1), -1, dtype=np.int64)     # every assignment comes from filling
+    assignments = engine.scored_matching(eligibility, candidates, np.zeros((n, 1)), np.random.default_rng(seed))
+
+    assert check_assignments(engine, problem, assignments) == 0
+
+
+def test_swaps_fill_a_user_when_everyone_allowed_is_full(engine):
+    problem = random_problem(4, blacklist=0)
+    problem["sex"] = problem["partner_sex"] = np.zeros(4, dtype=np.int8)
+    eligibility = engine.Eligibility(4)
+
+    # 0, 1 and 2 take each other and are full, so 3 can only get assignments by swapping itself in
+    assignments = np.array([[1, 2], [0, 2], [0, 1], [-1, -1]])
+    out_degree = (assignments >= 0).sum(axis=1)
+    in_degree = np.bincount(assignments[assignments >= 0], minlength=4)
+
+    engine.fill_by_swaps(eligibility, np.array([3]), assignments, out_degree, in_degree)
+
+    assert check_assignments(engine, problem, assignments) == 0
@@ -0,0 +1,66 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+
+mongomock_motor = pytest.importorskip("mongomock_motor")
+
+import app                                              # imports the handlers in the order the bot does
+from db import connect
+from db.operations.messages import migrate_messages, enforce_retention
+
+
+@pytest.fixture
+def messages():
+    client = mongomock_motor.AsyncMongoMockClient()
+    connect.mongo_messages = client["db"]["messages"]
+    connect.mongo_meta = client["db"]["meta"]
+    yield connect.mongo_messages
+    connect.mongo_messages = connect.mongo_meta = None
+
+
+def test_interrupted_migration_is_repeated(messages):
+    history = [
+        {"side": "bot", "datetime": "2024-01-01 10:00:00", "message": "Привет"},
+        {"side": "user", "datetime": "2024-01-01 10:01:00", "message": "Привет!"},
+    ]
+
+    async def run():
+        await messages.insert_one({"_id": 1, "messages": history})
+        await messages.insert_one({"_id": "1:0", "user_id": 1, **history[0]})      # inserted before a crash
+
+        await migrate_messages()
+        await migrate_messages()
+
+        return await messages.find({}, {"_id": 0}).sort("datetime", 1).to_list(None)
+
+    assert asyncio.run(run()) == [{"user_id": 1, **msg} for msg in history]
+
+
+def test_retention_deletes_old_messages(messages):
+    def days_ago(days):
+        return (datetime.now() - timedelta(days=days)).strftime("%Y-%m-%d %H:%M:%S")
+
+    async def run():
+        await messages.insert_many([{"user_id": 1, "side": "user", "datetime": days_ago(days), "message": str(days)}
+                                    for days in [400, 100, 1]])
+
+        retention = asyncio.create_task(enforce_retention(days=90))
+        await asyncio.sleep(0.1)
+        retention.cancel()
+
+        return [msg["message"] async for msg in messages.find({})]
+
+    assert asyncio.run(run()) == ["1"]
+
+
+def test_migration_is_skipped_once_done(messages):
+    async def run():
+        await migrate_messages()
+        await messages.insert_one({"_id": 1, "messages": [{"side": "bot", "datetime": "2024-01-01 10:00:00",
+                                                             "message": "Привет"}]})
+        await migrate_messages()
+
+        return await messages.count_documents({})
+
+    assert asyncio.run(run()) == 1                      # found nothing to migrate the first time, didn't look again
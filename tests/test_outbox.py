@@ -0,0 +1,65 @@
+import asyncio
+
+import pytest
+
+mongomock_motor = pytest.importorskip("mongomock_motor")
+
+import app                                              # imports the handlers in the order the bot does
+from db import connect
+from handlers.admin.matching import sending
+from handlers.admin.broadcast import SENT, BLOCKED
+
+
+@pytest.fixture
+def outbox():
+    connect.mongo_outbox = mongomock_motor.AsyncMongoMockClient()["db"]["outbox"]
+    yield connect.mongo_outbox
+    connect.mongo_outbox = None
+
+
+@pytest.fixture
+def sent(monkeypatch):
+    sent = []
+
+    async def send_limited(user_id, text):
+        if user_id == 2:
+            raise RuntimeError("unexpected")
+        if user_id == 3:
+            return BLOCKED
+
+        sent.append((user_id, text))
+        return SENT
+
+    monkeypatch.setattr(sending, "send_limited", send_limited)
+
+    return sent
+
+
+def test_error_with_one_entry_doesnt_stop_the_others(outbox, sent):
+    async def run():
+        await outbox.insert_many([
+            {"_id": f"run:{user_id}", "run_id": "run", "user_id": user_id, "messages": ["first", "second"],
+             "delivered": 0, "done": False}
+            for user_id in range(1, 21)
+        ])
+
+        pending = await sending.deliver_outbox("run", workers=4)
+
+        return pending, await sending.delivery_summary("run")
+
+    pending, summary = asyncio.run(run())
+
+    assert pending == 1
+    assert sorted(sent) == [(user_id, text) for user_id in [1, *range(4, 21)] for text in ["first", "second"]]
+    assert "Доставлено: 18/20" in summary and "Заблокировали бота: 1" in summary and "Не доставлено: 1" in summary
+
+
+def test_delivery_resumes_after_the_recorded_messages(outbox, sent):
+    async def run():
+        await outbox.insert_one({"_id": "run:1", "run_id": "run", "user_id": 1, "messages": ["first", "second"],
+                                 "delivered": 1, "done": False})
+
+        return await sending.deliver_outbox("run")
+
+    assert asyncio.run(run()) == 0
+    assert sent == [(1, "second")]
@@ -0,0 +1,91 @@
+import asyncio
+
+import pytest
+
+mongomock_motor = pytest.importorskip("mongomock_motor")
+
+from aiogram import types
+
+import app                                              # imports the handlers in the order the bot does
+from db import connect
+from db.operations.users import update_user, find_user
+from handlers.common.session_middleware import UserSessionMiddleware
+
+
+@pytest.fixture
+def users():
+    connect.mongo_users = mongomock_motor.AsyncMongoMockClient()["db"]["users"]
+    yield connect.mongo_users
+    connect.mongo_users = None
+
+
+def message(user_id):
+    return types.Message.model_validate({
+        "message_id": 1,
+        "date": 1700000000,
+        "chat": {"id": user_id, "type": "private"},
+        "from": {"id": user_id, "is_bot": False, "first_name": "test", "username": "user"},
+        "text": "test",
+    })
+
+
+def handle(handler):
+    """
+    Runs the handler for a message of user 1 through the session middleware.
+    """
+    return UserSessionMiddleware()(handler, message(1), {})
+
+
+def test_changes_are_committed_once_after_the_handler(users, monkeypatch):
+    async def handler(event, data):
+        await update_user(1, {"cache.email": "user@nes.ru"})
+        await update_user(1, {"cache.email_code": "123456"})
+
+        return await find_user(1)
+
+    async def run():
+        await users.insert_one({"_id": 1, "info": {"username": "user"}, "cache": {}})
+
+        writes = []
+        update_one = users.update_one
+
+        async def counted_update_one(*args, **kwargs):
+            writes.append(args)
+            return await update_one(*args, **kwargs)
+
+        monkeypatch.setattr(users, "update_one", counted_update_one)
+
+        seen = await handle(handler)
+
+        return seen, await find_user(1), writes
+
+    seen, stored, writes = asyncio.run(run())
+
+    assert seen["cache"] == stored["cache"] == {"email": "user@nes.ru", "email_code": "123456"}
+    assert len(writes) == 1
+
+
+def test_task_outliving_the_update_writes_directly(users):
+    async def run():
+        await users.insert_one({"_id": 1, "info": {"username": "user"}, "cache": {}})
+
+        handled = asyncio.Event()
+        tasks = []
+
+        async def background():
+            await handled.wait()
+            await update_user(1, {"cache.email_code": "123456"})
+
+        async def handler(event, data):
+            await update_user(1, {"cache.email": "during@nes.ru"})
+            tasks.append(asyncio.create_task(background()))            # copies the session with the context
+
+        await handle(handler)
+        handled.set()
+        await tasks[0]
+
+        return await find_user(1)
+
+    user = asyncio.run(run())
+
+    assert user["cache"] == {"email": "during@nes.ru", "email_code": "123456"}
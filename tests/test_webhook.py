@@ -0,0 +1,141 @@
+import os
+import signal
+import asyncio
+
+import pytest
+
+mongomock_motor = pytest.importorskip("mongomock_motor")
+
+from aiohttp.test_utils import TestClient, TestServer
+from aiogram import Bot, Dispatcher, Router
+
+import app                                              # imports the handlers in the order the bot does
+import intake
+import webhook
+from db import connect
+from configs.env_reader import config
+from conftest import free_port
+from test_intake import message_update, wait_handled
+
+
+SECRET = "secret"
+
+
+@pytest.fixture
+def updates():
+    connect.mongo_updates = mongomock_motor.AsyncMongoMockClient()["db"]["updates"]
+    yield connect.mongo_updates
+    connect.mongo_updates = None
+
+
+@pytest.fixture
+def handled():
+    return []
+
+
+@pytest.fixture
+def update_intake(handled, monkeypatch):
+    dp = Dispatcher()
+    router = Router()
+
+    @router.message()
+    async def handler(message):
+        handled.append(message.message_id)
+
+    dp.include_router(router)
+
+    update_intake = intake.UpdateIntake(dp, Bot(token=config.TG_BOT_TOKEN.get_secret_value()))
+    monkeypatch.setattr(webhook, "update_intake", update_intake)
+
+    return update_intake
+
+
+def serve(update_intake, requests):
+    """
+    Serves the webhook app on a local port and runs the coroutine `requests` with a client of it.
+    """
+    async def run():
+        app = webhook.create_app(update_intake.dp, update_intake.bot, SECRET)
+
+        async with TestClient(TestServer(app)) as client:
+            result = await requests(client)
+            await wait_handled(update_intake)
+
+            return result
+
+    return asyncio.run(run())
+
+
+def post(client, update, secret=SECRET):
+    headers = {} if secret is None else {"X-Telegram-Bot-Api-Secret-Token": secret}
+
+    return client.post(config.WEBHOOK_PATH, json=update, headers=headers)
+
+
+@pytest.mark.parametrize("secret", [None, "wrong"])
+def test_update_without_the_secret_is_rejected(updates, update_intake, handled, secret):
+    async def requests(client):
+        return (await post(client, message_update(1, 1), secret)).status
+
+    assert serve(update_intake, requests) == 401
+    assert handled == []
+    assert asyncio.run(updates.count_documents({})) == 0
+
+
+def test_update_is_stored_before_it_is_answered(updates, update_intake, handled):
+    async def requests(client):
+        response = await post(client, message_update(1, 1))
+
+        return response.status, await response.json(), await updates.count_documents({"_id": 1})
+
+    assert serve(update_intake, requests) == (200, {}, 1)
+    assert handled == [1]
+
+
+def test_concurrent_and_repeated_deliveries_are_handled_once(updates, update_intake, handled):
+    async def requests(client):
+        responses = await asyncio.gather(*(post(client, message_update(i % 50, i % 5)) for i in range(100)))
+
+        return {response.status for response in responses}
+
+    assert serve(update_intake, requests) == {200}
+    assert sorted(handled) == list(range(50))
+
+
+def test_health(updates, update_intake):
+    async def requests(client):
+        response = await client.get("/health")
+
+        return response.status, await response.json()
+
+    assert serve(update_intake, requests) == (200, {"status": "ok", "handling": 0})
+
+
+def test_sigterm_runs_the_shutdown(updates, update_intake, monkeypatch):
+    monkeypatch.setattr(config, "WEBHOOK_URL", "https://example.com")
+    monkeypatch.setattr(config, "WEBHOOK_HOST", "127.0.0.1")
+    monkeypatch.setattr(config, "WEBHOOK_PORT", free_port())
+
+    dp, bot = update_intake.dp, update_intake.bot
+    webhook_set = asyncio.Event()
+    shut_down = []
+
+    async def set_webhook(*args, **kwargs):
+        webhook_set.set()
+
+    async def on_shutdown():
+        shut_down.append(True)
+
+    monkeypatch.setattr(bot, "set_webhook", set_webhook)
+    dp.shutdown.register(on_shutdown)
+
+    async def run():
+        serving = asyncio.create_task(webhook.run_webhook(dp, bot))
+        await asyncio.wait_for(webhook_set.wait(), 5)
+
+        os.kill(os.getpid(), signal.SIGTERM)
+        await asyncio.wait_for(serving, 5)
+
+    asyncio.run(run())
+
+    assert shut_down == [True]